@@ -22,6 +22,10 @@
 #    Jonas Colmsjö, 2017-07-21: Converted to Python 3, added support for
 #    several agents, fixed logging etc.
 
+import sys
+
+import numpy as np
+
 # Setup logging
 # =============
 
@@ -40,7 +44,12 @@ def warn(*args):
 # The code
 # ========
 
+def _sizeofDict(d):
+    return sys.getsizeof(d) + sum([sys.getsizeof(v) for v in d.values()])
+
 class Action:
+    __slots__ = ('network', 'node', 'motor', 'triggers', 'R', 'Q', 'minQ', 'maxQ', 'rewardHistory', 'a_id')
+
     def __init__(self, network, node=None, motor=None, reward=None):
         self.network = network
         self.node = node
@@ -50,7 +59,7 @@ class Action:
         self.Q = {k:0 for k in network.objectives}
         self.minQ = {k:0 for k in network.objectives}
         self.maxQ = {k:0 for k in network.objectives}
-        self.rewardHistory = []
+        self.rewardHistory = network.createRewardHistory()
         if reward: self.updateQ(reward, 0)
 
     def __str__(self):
@@ -67,10 +76,7 @@ class Action:
 
     def updateQ(self, reward, Qsta1):
         self.triggers = self.triggers + 1
-
         self.rewardHistory.append(reward)
-        if len(self.rewardHistory) > self.network.config.max_reward_history:
-            del self.rewardHistory[0]
 
         # Update expected reward
         reward_discount = self.network.config.reward_learning_factor
@@ -78,7 +84,7 @@ class Action:
             # TODO: keep track of max/min-R?
             self.R[objective] = (1-reward_discount) * self.R[objective] + reward_discount * r
 
-        debug("updateQ - ...... Pre-Q", self.Q, ", name:", self.node.name + ', motor: ' + self.motor.name, ', reward:', reward, ", Qsta1:", Qsta1)
+        if DEBUG_MODE: debug("updateQ - ...... Pre-Q", self.Q, ", name:", self.node.name + ', motor: ' + self.motor.name, ', reward:', reward, ", Qsta1:", Qsta1)
         learning = self.network.config.q_learning_factor
         gamma = self.network.config.q_discount_factor
         for objective,r in list(reward.items()):
@@ -90,6 +96,7 @@ class Action:
             else:
                 self.minQ[objective] = min(self.minQ[objective], self.Q[objective])
                 self.maxQ[objective] = max(self.maxQ[objective], self.Q[objective])
+        self.network._actionUpdated(self)
         debug("updateQ - ...... NEW-Q", self.Q)
 
     def getV(self, objective=None):
@@ -119,8 +126,160 @@ class Action:
         else:
             return self.Q
 
+    # Approximate size in bytes of the action and its statistics, not counting
+    # the reward history.
+    def sizeof(self):
+        return sys.getsizeof(self) + sum([_sizeofDict(x) for x in [self.R, self.Q, self.minQ, self.maxQ]])
+
     def desc(self):
         return "%s: %s %d" % (self.motor.name, str(self.R), self.triggers)
 
     def d(self):
         return (self.motor.name, {'Q':self.Q, 'R':self.R, 'count':self.triggers})
+
+
+# Columnar action store
+# =====================
+#
+# Keeps the statistics of all actions in a network in arrays shaped
+# [action x objective], each ColumnarAction is a view of one row. The rows
+# of deleted actions are released and reused by new actions.
+# Enabled with "action_store": "columnar" in the network config.
+
+class ActionStore:
+    def __init__(self, objectives, capacity=256):
+        self.objectives = list(objectives)
+        self.columns = {k:i for i,k in enumerate(self.objectives)}
+        self.size = 0
+        self.R = np.zeros((capacity, len(self.objectives)))
+        self.Q = np.zeros((capacity, len(self.objectives)))
+        self.minQ = np.zeros((capacity, len(self.objectives)))
+        self.maxQ = np.zeros((capacity, len(self.objectives)))
+        self.triggers = np.zeros(capacity, dtype=np.int64)
+        self.free = []
+
+    # The number of rows in use
+    def __len__(self):
+        return self.size - len(self.free)
+
+    def allocate(self):
+        if self.free:
+            return self.free.pop()
+        if self.size == len(self.triggers):
+            self._grow(2*self.size)
+        self.size = self.size + 1
+        return self.size - 1
+
+    def release(self, row):
+        for column in [self.R, self.Q, self.minQ, self.maxQ, self.triggers]:
+            column[row] = 0
+        self.free.append(row)
+
+    def _grow(self, capacity):
+        for name in ['R', 'Q', 'minQ', 'maxQ', 'triggers']:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def get(self, column, row, objective=None):
+        if objective:
+            i = self.columns.get(objective)
+            return 0.0 if i is None else float(column[row, i])
+        else:
+            return dict(zip(self.objectives, column[row].tolist()))
+
+    def updateQ(self, row, reward, Qsta1, config):
+        self.triggers[row] = self.triggers[row] + 1
+
+        # Only the objectives in reward are updated
+        cols = [self.columns[k] for k in reward]
+        r = np.array([reward[k] for k in reward], dtype=float)
+        q = np.array([Qsta1.get(k, 0.0) for k in reward], dtype=float)
+
+        reward_discount = config.reward_learning_factor
+        self.R[row, cols] = (1-reward_discount) * self.R[row, cols] + reward_discount * r
+
+        Q = self.Q[row, cols]
+        Q = Q + config.q_learning_factor * (r + config.q_discount_factor*q - Q)
+        self.Q[row, cols] = Q
+        if self.triggers[row] == 1:
+            self.minQ[row, cols] = Q
+            self.maxQ[row, cols] = Q
+        else:
+            self.minQ[row, cols] = np.minimum(self.minQ[row, cols], Q)
+            self.maxQ[row, cols] = np.maximum(self.maxQ[row, cols], Q)
+
+    # The min, max, mean and trigger weighted mean of Q over rows, per objective
+    def aggregateQ(self, rows):
+        rows = np.array(rows, dtype=np.int64)
+        Q = self.Q[rows]
+        triggers = self.triggers[rows]
+        minQ = self.minQ[rows].min(axis=0)
+        maxQ = self.maxQ[rows].max(axis=0)
+        mean = Q.sum(axis=0) / len(rows)
+        n = triggers.sum()
+        if n == 0:
+            weighted = np.zeros(len(self.objectives))
+        else:
+            weighted = (Q * triggers[:,None]).sum(axis=0) / n
+        return {obj: {'min': float(minQ[i]), 'max': float(maxQ[i]), 'mean': float(mean[i]), 'weighted': float(weighted[i])}
+                for i,obj in enumerate(self.objectives)}
+
+
+class ColumnarAction(Action):
+    __slots__ = ('row',)
+
+    def __init__(self, network, node=None, motor=None, reward=None):
+        self.network = network
+        self.node = node
+        self.motor = motor
+        self.row = network._store.allocate()
+        self.rewardHistory = network.createRewardHistory()
+        if reward: self.updateQ(reward, 0)
+
+    @property
+    def triggers(self):
+        return int(self.network._store.triggers[self.row])
+
+    @property
+    def R(self):
+        return self.getR()
+
+    @property
+    def Q(self):
+        return self.getQ()
+
+    @property
+    def minQ(self):
+        return self.getMinQ()
+
+    @property
+    def maxQ(self):
+        return self.getMaxQ()
+
+    def updateQ(self, reward, Qsta1):
+        self.rewardHistory.append(reward)
+        self.network._store.updateQ(self.row, reward, Qsta1, self.network.config)
+        self.network._actionUpdated(self)
+        if DEBUG_MODE: debug("updateQ - ...... NEW-Q", self.Q, ", name:", self.node.name + ', motor: ' + self.motor.name)
+
+    # The size of the object and its row in the store
+    def sizeof(self):
+        store = self.network._store
+        return sys.getsizeof(self) + sum([getattr(store, x).itemsize * len(store.objectives) for x in ['R', 'Q', 'minQ', 'maxQ']]) + store.triggers.itemsize
+
+    def getV(self, objective=None):
+        return self.getR(objective)
+
+    def getR(self, objective=None):
+        return self.network._store.get(self.network._store.R, self.row, objective)
+
+    def getMinQ(self, objective=None):
+        return self.network._store.get(self.network._store.minQ, self.row, objective)
+
+    def getMaxQ(self, objective=None):
+        return self.network._store.get(self.network._store.maxQ, self.row, objective)
+
+    def getQ(self, objective=None):
+        return self.network._store.get(self.network._store.Q, self.row, objective)
@@ -23,9 +23,15 @@
 import math
 import itertools
 
+import numpy as np
+
 from .motor import *
 from .sensor import *
 from .network import *
+from .objectives import relativeSurprise
+from .fieldofview import FieldOfView
+from .surprise import SurpriseMatrix
+from .trail import Trail
 from . import environment
 from . import nodes
 
@@ -50,33 +56,19 @@ def warn(*args):
 # The code
 # ========
 
-def dist(a,b):
-    return math.sqrt(sum([ pow(a.get(k,0) - b.get(k,0), 2.0) for k in list(a.keys())]))
-
-def length(x):
-    return math.sqrt(sum([v**2 for v in list(x.values())]))
-
-def relative_surprise(a,b):
-    l = min(max(length(a), 0.01), max(length(b), 0.01))
-    return dist(a,b)/l
-
-def averageDict( a, b, keys, sigma ):
-    return {k:(1-sigma)*a.get(k,0)+sigma*b.get(k,0) for k in keys}
-
+# x and c are vectors over the objectives
 def wellbeeing_min(x, c):
-    return min([max(c.get(k,-1e99), v) for k,v in list(x.items())])
+    return float(np.maximum(c, x).min())
 
 def wellbeeing_prod(x, c):
-    p = 1
-    for k,v in list(x.items()):
-        p = p * max( c.get(k,-1e99), v )
-    return p
+    return float(np.maximum(c, x).prod())
 
 WELLBEEING_FUNCTIONS = { 'min':wellbeeing_min, 'product':wellbeeing_prod }
 
 # Create a basic network that supports this environment
 def createNetwork(conf, objectives, seed):
-    sensors = [SensorNode("$"+sensor, None) for sensor in conf.sensors]
+    # There is a sensor of every cell in the field of view
+    sensors = [SensorNode("$"+sensor, None) for sensor in FieldOfView.fromConfig(conf.field_of_view).sensorNames(conf.sensors)]
     motors = [Motor(motor) for motor in conf.motors]
     return Network(conf, sensors, motors, objectives, seed)
 
@@ -89,12 +81,30 @@ class AgentConfig:
         self.seed = conf.get("seed", 0)
         self.network = NetworkConfig(conf.get("network", {}))
         self.surprise_const = conf.get("surprise_const", 2.0)
+        self.surprise_limit = conf.get("surprise_limit", None)
+        self.surprise_eviction = conf.get("surprise_eviction", "lru")
         self.wellbeeing_const = conf.get("wellbeeing_const", {})
         self.wellbeeing_function = conf.get("wellbeing_function", "min")
 
         #self.PLOTTER_ENABLED = conf.get("PLOTTER_ENABLED", False)
         #self.PLOTTER_EVERY_FRAME = conf.get("PLOTTER_EVERY_FRAME", False)
         self.features = conf.get("features", {})
+        self.pruning = PruningConfig(conf.get("pruning", {}))
+
+# Top nodes older than min_age are pruned unless they reach one of the
+# min_triggers, min_activations or min_q_spread thresholds. When there are
+# more than max_nodes nodes, or they use more than max_bytes, the least
+# valuable top nodes are pruned until the budget is met, regardless of age.
+class PruningConfig:
+    def __init__(self, conf):
+        self.enabled = conf.get("enabled", False)
+        self.interval = conf.get("interval", 100)
+        self.min_age = conf.get("min_age", 100)
+        self.min_triggers = conf.get("min_triggers", 20)
+        self.min_activations = conf.get("min_activations", 20)
+        self.min_q_spread = conf.get("min_q_spread", 0.05)
+        self.max_nodes = conf.get("max_nodes", None)
+        self.max_bytes = conf.get("max_bytes", None)
 
 # y=0 up
 # x=0 left
@@ -110,31 +120,48 @@ class Agent(AgentClass):
         self.network = network
         self.growthRate = growthRate
         self.needs = needs or {need:1.0 for need in network.objectives}
-        self.trail = []
-        self.wellbeeingTrail = []
+        self.trail = Trail()
         self._learningData = None
         self._previousTopNodes = []
-        self.surpriseMatrix = {}
-        self.surpriseMatrix_SEQ = {}
+        self.surpriseMatrix = SurpriseMatrix(network, config.surprise_limit, config.surprise_eviction)
+        self.surpriseMatrix_SEQ = SurpriseMatrix(network, config.surprise_limit, config.surprise_eviction)
         self._wellbeeingFunc = WELLBEEING_FUNCTIONS.get(config.wellbeeing_function)
-        self.previousSensors = []
+        self._wellbeeingConst = network.objectiveSpace.vector(config.wellbeeing_const, -1e99)
+        # fear isn't changed by rewards
+        self._changeableNeeds = np.array([k != 'fear' for k in network.objectiveOrder], dtype=bool)
+        self.previousSensors = 0
+
+    # The needs are kept as a vector over the objectives, the dict is for
+    # status and output
+    @property
+    def needs(self):
+        return self.network.objectiveSpace.dict(self.needVector)
+
+    @needs.setter
+    def needs(self, needs):
+        self.needVector = self.network.objectiveSpace.vector(needs)
+
+    # The wellbeeing after every action, recorded in the trail
+    @property
+    def wellbeeingTrail(self):
+        return list(self.trail.iterWellbeeings())
 
     def wellbeeing(self):
-        return self._wellbeeingFunc(self.needs, self.config.wellbeeing_const)
+        return self._wellbeeingFunc(self.needVector, self._wellbeeingConst)
 
     def is_alive(self):
         return self.wellbeeing() > 0.0
 
     # ignoring percepts, the sensors have already been updated
     def program(self, _):
-        debug("program - TICK:", self.network.time, ", network: ", self.network, "NETWORK:", list(self.network.nodes.keys()))
+        if DEBUG_MODE: debug("program - TICK:", self.network.time, ", network: ", self.network, "NETWORK:", [x.getName() for x in self.network.allNodes()])
 
         # OBSERVE - Read new inputs and update Activation and Status
 
         # Check if stimuly changed from previous frame, this is used to DECIDE
         # when to propagate "previous state" for SEQ nodes.
-        if self.previousSensors != self.network.activeSensors():
-            self.previousSensors = self.network.activeSensors()
+        if self.previousSensors != self.network.activeSensorMask():
+            self.previousSensors = self.network.activeSensorMask()
             self.sensorsChanged = True
             debug("program - sensors changed", self.network.time)
         else:
@@ -144,16 +171,20 @@ class Agent(AgentClass):
         # Learning began last tick, follow up with the new Q.
         self._endLearning()
 
+        pruning = self.config.pruning
+        if pruning.enabled and self.network.time % pruning.interval == 0:
+            self._prune()
+
         # should check sensor!!
         cell = [x.name for x in self.network.activeSensors()] #self.environment.currentCell(self)
-        debug('program - activeSensors:', [x.name for x in self.network.activeSensors()], ", cell:", cell, ", top:", ", ".join([x.name for x in self.network.topNodes()]), ", top active:", ", ".join([x.name for x in self.network.activeTopNodes()]), ", previous top active:", ", ".join([x.name for x in self._previousTopNodes]), ", all:", ", ".join(["%s=%s" % (x.getName(), x.isActive() and "on" or "off") for x in self.network.allNodes()]), ", needs:", self.needs)
+        if DEBUG_MODE: debug('program - activeSensors:', [x.name for x in self.network.activeSensors()], ", cell:", cell, ", top:", ", ".join([x.name for x in self.network.topNodes()]), ", top active:", ", ".join([x.name for x in self.network.activeTopNodes()]), ", previous top active:", ", ".join([x.name for x in self._previousTopNodes]), ", all:", ", ".join(["%s=%s" % (x.getName(), x.isActive() and "on" or "off") for x in self.network.allNodes()]), ", needs:", self.needs)
 
         # DECIDE - select ACTION for the node under attention that maximizes
         # expected lifespan (EXPLOIT) or tries a new state-action pair (EXPLORE)
         score, action, Q = self.network.getBestAction(self.needs)
 
         if action:
-            prediction,numPredictions = self.network.predictR(action)
+            prediction,numPredictions = self.network.predictRVector(action)
 
         return (action, prediction, numPredictions)
 
@@ -168,11 +199,10 @@ class Agent(AgentClass):
 
         if not action: return
 
-        surprise = relative_surprise(prediction, reward)
+        surprise = relativeSurprise(prediction, reward)
         debug("takeAction >>> - best action:", action, ", surprise:", surprise, ", numPredictions:", numPredictions, ", prediction:", prediction, ", reward:", reward, ", cell:", cell, ", action:", action,)
 
-        self.trail.append( (cell, action) )
-        self.wellbeeingTrail.append( self.wellbeeing() )
+        self.trail.append(cell, action, self.wellbeeing())
         self._beginLearning(surprise, reward, action, prediction, numPredictions)
 
         # update status vector
@@ -183,42 +213,34 @@ class Agent(AgentClass):
         debug("mostUrgentNeed - needs:", self.needs)
         return sorted([(v,k) for k,v in list(self.needs.items())])[0][1]
 
+    # deltaNeeds is a reward vector or a scalar that is applied to all needs
     def _updateNeeds(self, deltaNeeds):
-        if type(deltaNeeds) == dict:
-            for k,v in list(deltaNeeds.items()):
-                if k != 'fear':
-                    self.needs[k] = max( min(self.needs[k] + v, 1.0), 0)
-        else: # it's a scalar, apply to all needs
-            for k,v in list(self.needs.items()):
-                if k != 'fear':
-                    self.needs[k] = max( min(v + deltaNeeds, 1.0), 0)
+        changed = self._changeableNeeds
+        if np.ndim(deltaNeeds) > 0:
+            changed = changed & ~np.isnan(deltaNeeds)
+        self.needVector[changed] = np.clip(self.needVector + deltaNeeds, 0.0, 1.0)[changed]
 
-        debug("_updateNeeds - needs:", self.needs)
+        if DEBUG_MODE: debug("_updateNeeds - needs:", self.needs)
 
     def _updateSurpriseMatrix(self, surprise, reward, action, numPredictions):
         # Don't build on top of Virtual nodes
-        debug("_updateSurpriseMatrix - numPredictions:", numPredictions, ", surprise:", surprise, ", surprise_const:", self.config.surprise_const, ", surpriseMatrix:", self.surpriseMatrix)
+        if DEBUG_MODE: debug("_updateSurpriseMatrix - numPredictions:", numPredictions, ", surprise:", surprise, ", surprise_const:", self.config.surprise_const, ", surpriseMatrix:", self.surpriseMatrix.d())
         topnodes = self.network.activeTopNodes(includeVirtual=False)
 
-        for a,b in itertools.combinations(topnodes, 2):
-            pP = self.surpriseMatrix.get((a.name, b.name), reward)
-            self.surpriseMatrix[(a.name,b.name)] = averageDict( pP, reward, self.network.objectives, 0.5 )
-
-        for a,b in itertools.product(self._previousTopNodes, topnodes):
-            pP = self.surpriseMatrix_SEQ.get((a.name, b.name), reward)
-            self.surpriseMatrix_SEQ[(a.name, b.name)] = averageDict( pP, reward, self.network.objectives, 0.1 )
+        self.surpriseMatrix.update([(a.n_id, b.n_id) for a,b in itertools.combinations(topnodes, 2)], reward, 0.5)
+        self.surpriseMatrix_SEQ.update([(a.n_id, b.n_id) for a,b in itertools.product(self._previousTopNodes, topnodes)], reward, 0.1)
 
         # TODO: only combine with the least surprised node?
         # then we have to calculate the best action, given status, for each nodes actions
         # and then relative_surprise given the expected reward
         if surprise > self.config.surprise_const and numPredictions > 2:
-            surprises = sorted([(relative_surprise(node.getR(action), reward), node) for node in topnodes])
-            xSurprises = sorted([(relative_surprise(v, reward), k, v) for k,v in list(self.surpriseMatrix.items())])
+            space = self.network.objectiveSpace
+            surprises = sorted([(relativeSurprise(space.vector(node.getR(action)), reward), node) for node in topnodes], key=lambda x: x[0])
             # TODO: take the least surprised combination?
             if len(surprises) > 1 and self.config.features.get("AND", False):
                 _,a = leastSurprised = surprises[0]
                 _,b = mostSurprised = surprises[-1]
-                debug("_updateSurpriseMatrix - surprises:", surprises, ", mostSurprised:", mostSurprised, ", leastSurprised:", leastSurprised, ", xSurprises", xSurprises)
+                if DEBUG_MODE: debug("_updateSurpriseMatrix - surprises:", surprises, ", mostSurprised:", mostSurprised, ", leastSurprised:", leastSurprised, ", xSurprises", self.surpriseMatrix.leastSurprised(reward, self._pairNames))
                 # Don't add nodes with the same input, or one that shares the same forefather
                 if a == b or a.isParent(b) or b.isParent(a) or self.network.hasAndNode([a,b]):
                     pass
@@ -228,21 +250,26 @@ class Agent(AgentClass):
                     # TODO: make sure it learns the correct action from the start.
                     # Since it's not a top-active node it will not get feedback.
                     # Check this...
-                    n.updateQ(action, reward, environment.makeRewardDict(0, self.needs))
+                    n.updateQ(action, self.network.objectiveSpace.dict(reward), environment.makeRewardDict(0, self.needs))
                     debug("_updateSurpriseMatrix - >>>> Grew a new AND-node", n.desc())
             elif self.config.features.get("SEQ", False):
-                seqSurprises = sorted([(relative_surprise(v, reward), k) for k,v in list(self.surpriseMatrix_SEQ.items())])
-                if len(seqSurprises) > 0:
-                    a,b = seqSurprises[0][1]
-                    a,b = self.network.findNode(a), self.network.findNode(b)
-                    if seqSurprises[0][0] < 0.5 and not self.network.hasSeqNode([a,b]):
+                # Only the least surprised pair is used, ties are broken by
+                # the names of the nodes
+                best = self.surpriseMatrix_SEQ.leastSurprised(reward, self._pairNames)
+                if best is not None:
+                    seqSurprise,(a,b) = best
+                    a,b = self.network.nodes[a], self.network.nodes[b]
+                    if seqSurprise < 0.5 and not self.network.hasSeqNode([a,b]):
                         #if a.isParent(b) or b.isParent(a) or self.network.hasSeqNode([a,b]):
                         #continue
                         n = nodes.SEQNode(inputs=[a, b], virtual=False)
                         self.network.addNode(n)
-                        n.updateQ(action, reward, environment.makeRewardDict(0, self.needs))
+                        n.updateQ(action, self.network.objectiveSpace.dict(reward), environment.makeRewardDict(0, self.needs))
                         debug("_updateSurpriseMatrix - >>>> Grew a new SEQ-node", n.desc())
 
+    def _pairNames(self, pair):
+        return (self.network.nodes[pair[0]].getName(), self.network.nodes[pair[1]].getName())
+
     def _beginLearning(self, surprise, reward, action, prediction, numPredictions):
         topnodes = self.network.activeTopNodes(includeVirtual=False)
 
@@ -254,14 +281,14 @@ class Agent(AgentClass):
 
         nodes = self._learningData['nodes']
         motor = self._learningData['action']
-        reward = self._learningData['reward']
+        reward = self.network.objectiveSpace.dict(self._learningData['reward'])
         newTopnodes = self.network.activeTopNodes(includeVirtual=False)
         previousTop = self._learningData['previousTop']
 
         score,q_action,Q = self.network.getBestAction(self.needs, epsilon=0)
         Qst1a = {obj:x['weighted'] for obj,x in list(Q.items())}
 
-        debug("_endLearning - >>> END LEARNING", motor, reward, Qst1a, [x.getName() for x in nodes])
+        if DEBUG_MODE: debug("_endLearning - >>> END LEARNING", motor, reward, Qst1a, [x.getName() for x in nodes])
 
         # Learn casuality for all active top-nodes
         for node in nodes:
@@ -272,10 +299,62 @@ class Agent(AgentClass):
             self._previousTopNodes = nodes
         self._learningData = None
 
-    # def _prune(self):
-    #     # TODO: Don't prune sensors or first layer nand
-    #     for n in self.network.topNodes():
-    #         if n.getAge()>100 and n.getNumActions()<2 and n.getNumTriggers()<20:
-    #             print "PRUNE", n.d()
-    #             self.network.deleteNode(n)
-    #
+    # Delete low-value top nodes, their actions and surprise matrix entries.
+    # Returns what was reclaimed.
+    def _prune(self):
+        conf = self.config.pruning
+        deleted = []
+        # Memory usage is measured once, deleted nodes are subtracted
+        usage = self.network.memoryUsage()
+        total, freed = usage['total'], 0
+
+        def delete(candidates):
+            nonlocal total, freed
+            for n in candidates:
+                numActions = len(n.actions)
+                size = self.network.nodeMemory(n)
+                if self.network.deleteNode(n):
+                    deleted.append((n, numActions))
+                    total -= size
+                    freed += size
+
+        delete([n for n in self._pruneCandidates() if n.getAge() >= conf.min_age and
+                n.getNumTriggers() < conf.min_triggers and n.activations < conf.min_activations and
+                n.getQSpread() < conf.min_q_spread])
+
+        # Deleting top nodes can make their inputs top nodes
+        excess = self._overBudget(total, usage['bytes_per_node'])
+        while excess > 0:
+            candidates = sorted(self._pruneCandidates(), key=lambda n: (n.getAge() < conf.min_age, n.getQSpread(),
+                                                                        n.getNumTriggers(), n.activations, n.n_id))
+            numDeleted = len(deleted)
+            delete(candidates[:excess])
+            if len(deleted) == numDeleted: break
+            excess = self._overBudget(total, usage['bytes_per_node'])
+
+        self.network.updateTopActive()
+
+        ids = set(n.n_id for n,_ in deleted)
+        pairs = self.surpriseMatrix.removeNodes(ids) + self.surpriseMatrix_SEQ.removeNodes(ids)
+        self._previousTopNodes = [n for n in self._previousTopNodes if n.n_id not in ids]
+
+        report = {'nodes': len(deleted), 'actions': sum(n for _,n in deleted), 'surprise_pairs': pairs,
+                  'bytes': freed}
+        if DEBUG_MODE: debug("_prune - reclaimed:", report, ", deleted:", sorted([n.getName() for n,_ in deleted]))
+        return report
+
+    # The number of nodes to delete to fit the budget, given the current
+    # memory usage. The memory is estimated from the average size of a node.
+    def _overBudget(self, total, bytesPerNode):
+        conf = self.config.pruning
+        excess = 0
+        if conf.max_nodes is not None:
+            excess = len(self.network.nodes) - conf.max_nodes
+        if conf.max_bytes is not None and total > conf.max_bytes:
+            excess = max(excess, math.ceil((total - conf.max_bytes) / bytesPerNode))
+        return excess
+
+    # Real top nodes that can be deleted. Sensors are permanent, and nodes
+    # with virtual outputs are kept.
+    def _pruneCandidates(self):
+        return [n for n in self.network.topNodes() if not n.permanent and not n.outputs]
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+#    pyAnimat - Simulate Animats using Transparent Graphs as a way to AGI
+#    Copyright (C) 2017  Nils Svangård, Claes Strannegård
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# A frozen network compiled to flat arrays, for deploying trained networks.
+# The compiled network ticks and decides like Network.tick and an exploiting
+# Network.getBestAction, but it doesn't learn or grow.
+
+import numpy as np
+
+from .node import Node
+from .nodes import AndNode, NAndNode, SEQNode
+
+
+# Setup logging
+# =============
+
+DEBUG_MODE = False
+
+def debug(*args):
+    if DEBUG_MODE: print('DEBUG:compiled:', *args)
+
+def error(*args):
+    print('ERROR:compiled:', *args)
+
+def warn(*args):
+    print('WARNING:compiled:', *args)
+
+
+# The code
+# ========
+
+OP_FALSE = 0
+OP_AND = 1
+OP_NAND = 2
+OP_SEQ = 3
+
+def _opcode(node):
+    if isinstance(node, SEQNode): return OP_SEQ
+    if isinstance(node, NAndNode): return OP_NAND
+    if isinstance(node, AndNode): return OP_AND
+    if type(node) == Node: return OP_FALSE
+    raise ValueError("can't compile node %s of type %s" % (node.getName(), type(node).__name__))
+
+# The edges of nodes as flat arrays, the edges of nodes[i] starts at
+# starts[i]. Each node must have at least one edge.
+def _csr(nodes, edges):
+    flat = []
+    starts = []
+    for i in nodes:
+        starts.append(len(flat))
+        flat.extend(edges[i])
+    return (np.array(nodes, dtype=np.int64), np.array(flat, dtype=np.int64), np.array(starts, dtype=np.int64))
+
+class CompiledNetwork:
+    def __init__(self, network):
+        self.network = network
+        self.time = network.time
+        self.objectives = list(network.objectives)
+        self.motors = [motor.name for motor in network.motors]
+        self._qFunc = network._qFunc
+        self._utilityFunc = network._utilityFunc
+        self._compileNodes(network)
+        self._compileActions(network)
+
+    def _compileNodes(self, network):
+        self.nodes = list(network.nodes.values())
+        index = {node:i for i,node in enumerate(self.nodes)}
+        n = len(self.nodes)
+
+        self.sensors = np.array([index[x] for x in network.sensors], dtype=np.int64)
+        self.sensorKeys = []
+        for x in network.sensors:
+            if x.sense is not None:
+                raise ValueError("can't compile sensor %s with a sense function" % x.getName())
+            self.sensorKeys.append(x.getName()[1:])
+        # The bit of every sensor in the masks given to tickSensors
+        self.sensorIds = [x.n_id for x in network.sensors]
+
+        for x in self.nodes:
+            for i in x.inputs:
+                if i not in index:
+                    raise ValueError("can't compile node %s, input %s isn't in the network" % (x.getName(), i.getName()))
+
+        self.active = np.array([x.active for x in self.nodes], dtype=bool)
+        self.previous = np.array([x.previousActive for x in self.nodes], dtype=bool)
+        self.pending = np.array([x.pendingPreviousActive for x in self.nodes], dtype=bool)
+        self.topActive = np.array([x.isTopActive() for x in self.nodes], dtype=bool)
+
+        # Evaluation levels, all inputs of a node are on lower levels
+        isSensor = np.zeros(n, dtype=bool)
+        isSensor[self.sensors] = True
+        level = [0]*n
+        for i,x in enumerate(self.nodes):
+            if not isSensor[i]:
+                level[i] = 1 + max([level[index[y]] for y in x.inputs] + [0])
+        inputs = [[index[y] for y in x.inputs] for x in self.nodes]
+
+        self.levels = []
+        for l in sorted(set(level[i] for i in range(n) if not isSensor[i])):
+            nodes = [i for i in range(n) if level[i] == l and not isSensor[i]]
+            ops = {}
+            for i in nodes:
+                ops.setdefault(_opcode(self.nodes[i]), []).append(i)
+            const = [i for i in ops.get(OP_NAND, []) if len(inputs[i]) == 0]
+            gates = [(op, [i for i in ops.get(op, []) if len(inputs[i]) > 0]) for op in (OP_AND, OP_NAND)]
+            seq = [i for i in ops.get(OP_SEQ, []) if len(inputs[i]) > 1]
+            self.levels.append((
+                np.array(nodes, dtype=np.int64),
+                np.array(const, dtype=np.int64),
+                [(op, _csr(g, inputs)) for op,g in gates if g],
+                np.array(seq, dtype=np.int64),
+                np.array([inputs[i][0] for i in seq], dtype=np.int64),
+                np.array([inputs[i][1] for i in seq], dtype=np.int64)))
+
+        # Top-active detection, nodes grouped by height over the real outputs
+        outputs = [[index[y] for y in x.outputs if y in index and not y.isVirtual()] for x in self.nodes]
+        height = [0]*n
+        for i in reversed(range(n)):
+            height[i] = 1 + max([height[o] for o in outputs[i]] + [-1])
+        self.heights = [_csr([i for i in range(n) if outputs[i] and height[i] == h], outputs)
+                        for h in range(1, max(height + [0]) + 1)]
+        self.hasOutputs = np.array([len(o) > 0 for o in outputs], dtype=bool)
+
+        # Nodes reachable from the sensors through real outputs, see
+        # Network._findTopActive
+        reachable = np.zeros(n, dtype=bool)
+        reachable[self.sensors] = True
+        for i in range(n):
+            if not reachable[i] and not self.nodes[i].isVirtual():
+                reachable[i] = any(reachable[j] for j in inputs[i])
+        self.reachable = reachable
+
+    def _compileActions(self, network):
+        index = {node:i for i,node in enumerate(self.nodes)}
+        motors = {name:i for i,name in enumerate(self.motors)}
+        actions = sorted([a for a in network.actions.values() if a.motor.name in motors], key=lambda x: x.a_id)
+
+        # Actions of nodes that has been deleted are never available
+        self.actionNode = np.array([index.get(a.node, -2) if a.node is not None else -1 for a in actions], dtype=np.int64)
+        self.actionMotor = np.array([motors[a.motor.name] for a in actions], dtype=np.int64)
+        self.triggers = np.array([a.triggers for a in actions], dtype=np.int64)
+        shape = (len(actions), len(self.objectives))
+        self.R = np.array([[a.getR(k) for k in self.objectives] for a in actions], dtype=float).reshape(shape)
+        self.Q = np.array([[a.getQ(k) for k in self.objectives] for a in actions], dtype=float).reshape(shape)
+        self.minQ = np.array([[a.getMinQ(k) for k in self.objectives] for a in actions], dtype=float).reshape(shape)
+        self.maxQ = np.array([[a.getMaxQ(k) for k in self.objectives] for a in actions], dtype=float).reshape(shape)
+
+    def tick(self, observation=None):
+        self._tick(np.array([bool(observation.get(k, 0)) for k in self.sensorKeys], dtype=bool))
+
+    # Like Network.tickSensors, the observation is a bitmask over the node
+    # ids of the sensors, e.g. from the field of view of an Environment
+    def tickSensors(self, mask):
+        self._tick(np.array([mask >> i & 1 == 1 for i in self.sensorIds], dtype=bool))
+
+    def _tick(self, sensors):
+        self.time = self.time + 1
+        changed = (sensors != self.active[self.sensors]).any()
+
+        # Every node is evaluated on every tick, the sensors first
+        self.pending[self.sensors] = self.active[self.sensors]
+        self.active[self.sensors] = sensors
+        if changed:
+            self.previous[:] = self.pending
+        for nodes, const, gates, seq, first, second in self.levels:
+            self.pending[nodes] = self.active[nodes]
+            self.active[nodes] = False
+            self.active[const] = True
+            for op, (gateNodes, edges, starts) in gates:
+                value = np.logical_and.reduceat(self.active[edges], starts)
+                self.active[gateNodes] = value if op == OP_AND else ~value
+            self.active[seq] = self.previous[first] & self.active[second]
+
+        self._findTopActive()
+
+    def _findTopActive(self):
+        above = self.active.copy()
+        aboveOutputs = np.zeros(len(self.nodes), dtype=bool)
+        for nodes, edges, starts in self.heights:
+            aboveOutputs[nodes] = np.logical_or.reduceat(above[edges], starts)
+            above[nodes] = above[nodes] | aboveOutputs[nodes]
+        self.topActive = self.active & ~aboveOutputs & self.reachable
+
+    def activeTopNodes(self):
+        return [self.nodes[i] for i in np.nonzero(self.topActive)[0]]
+
+    # Aggregated Q of the available actions per motor, like Network.motorQ.
+    # Motors without available actions are left out.
+    def motorQ(self):
+        node = self.actionNode
+        available = (node == -1) | ((node >= 0) & self.topActive[np.maximum(node, 0)])
+        rows = np.nonzero(available)[0]
+        if len(rows) == 0: return {}
+        rows = rows[np.argsort(self.actionMotor[rows], kind='stable')]
+        motors, starts = np.unique(self.actionMotor[rows], return_index=True)
+
+        counts = np.diff(np.append(starts, len(rows)))
+        triggers = self.triggers[rows]
+        minQ = np.minimum.reduceat(self.minQ[rows], starts)
+        maxQ = np.maximum.reduceat(self.maxQ[rows], starts)
+        mean = np.add.reduceat(self.Q[rows], starts) / counts[:,None]
+        n = np.add.reduceat(triggers, starts)
+        weighted = np.add.reduceat(self.Q[rows] * triggers[:,None], starts) / np.maximum(n, 1)[:,None]
+        weighted[n == 0] = 0.0
+
+        res = {}
+        for m in range(len(motors)):
+            res[self.motors[motors[m]]] = {obj: {'min': float(minQ[m,k]), 'max': float(maxQ[m,k]), 'mean': float(mean[m,k]), 'weighted': float(weighted[m,k])}
+                                           for k,obj in enumerate(self.objectives)}
+        return res
+
+    # The best action for status, same as an exploiting Network.getBestAction
+    def getBestAction(self, status):
+        best = None
+        for motor, actionQ in self.motorQ().items():
+            newQ = {objective:self._qFunc(Q, status) for objective,Q in list(actionQ.items())}
+            score = self._utilityFunc(newQ, status)
+            if best is None or score > best[0]:
+                best = (score, motor, actionQ)
+        debug("getBestAction - action:", best)
+        return best
@@ -25,10 +25,14 @@ import datetime
 import itertools
 import random
 
+import numpy as np
+
 from . import agent as agentModule
 from .network import *
 from .sensor import *
 from .motor import *
+from .objectives import Objectives
+from .fieldofview import FieldOfView, parseSensorName
 
 import agents
 
@@ -56,12 +60,16 @@ def makeRewardDict(reward, needs):
         reward = {k:reward for k in list(needs.keys())}
     return reward
 
+# The direction of the moves relative to the orientation of the agent, see
+# ORIENTATION_MATRIX, and the turns
+MOVES = {'up': 0, 'right': 2, 'down': 4, 'left': 6}
+TURNS = {'turn_right': 1, 'turn_left': -1}
+
 class EnvironmentConfig:
     def __init__(self, conf):
 #        worldmap = "rrrrrrrrrr\ngggggggggg\n0000000000\nbbbbbbbbbb\nxxxxxxxxxx"
         self.worldmap = conf.get("world")
 
-        self.world = [list(x) for x in conf.get("world").split("\n")]
         self.blocks = conf.get("blocks", {})
         self.is_torus = conf.get("torus", False)
         self.transform = conf.get("transform", {})
@@ -70,6 +78,102 @@ class EnvironmentConfig:
         self.maxIterations = conf.get("iterations", 100)
         self.enable_playback = conf.get("playback", False)
 
+        # The world is a grid of block codes, blockNames[code] is the block
+        rows = self.worldmap.split("\n")
+        if len(set([len(x) for x in rows])) != 1:
+            raise ValueError("all rows of the world must have the same length")
+        self.blockNames = []
+        self._blockCodes = {}
+        for block in itertools.chain(*rows, self.blocks, *[x.values() for x in self.transform.values()]):
+            self.blockCode(block)
+        dtype = np.uint8 if len(self.blockNames) <= 256 else np.uint16
+        self.world = np.array([[self.blockCode(x) for x in row] for row in rows], dtype=dtype)
+
+        # The motors of the agents and those in the rewards and transforms
+        self.motorNames = []
+        self._motorCodes = {}
+        motors = (conf.get("agent") or {}).get("network", {}).get("motors", [])
+        for motor in itertools.chain(motors, self.rewardMatrix, self.transform):
+            if motor != '*': self.motorCode(motor)
+
+        self.objectiveSpace = Objectives(self.objectives)
+        self.batched = conf.get("batched", False)
+        self.compile()
+
+    # The code of block, new blocks are given the next code
+    def blockCode(self, block):
+        code = self._blockCodes.get(block)
+        if code is None:
+            code = len(self.blockNames)
+            self.blockNames.append(block)
+            self._blockCodes[block] = code
+        return code
+
+    def motorCode(self, motor):
+        code = self._motorCodes.get(motor)
+        if code is None:
+            code = len(self.motorNames)
+            self.motorNames.append(motor)
+            self._motorCodes[motor] = code
+        return code
+
+    # Compile the rewards, transforms and moves of the motors and blocks,
+    # done again when new motors or blocks has been added
+    def compile(self):
+        self.rewards, self.rawRewards = self._compileRewards()
+        self.transforms = self._compileTransforms()
+        self.moves = np.array([MOVES.get(x, -1) for x in self.motorNames], dtype=np.int64)
+        self.turns = np.array([TURNS.get(x, 0) for x in self.motorNames], dtype=np.int64)
+        self.orientations = np.array(agentModule.ORIENTATION_MATRIX, dtype=np.int64)
+
+    def isCompiled(self):
+        return self.transforms.shape == (len(self.motorNames), len(self.blockNames))
+
+    # The rewards as a read-only [motor x block x objective] array with the
+    # wildcards expanded. Objectives missing from a reward are nan. The
+    # rewards as configured, scalars or dicts, are also kept in [motor][block]
+    # lists for agents with other objectives than the environment.
+    def _compileRewards(self):
+        rm = self.rewardMatrix
+        rewards = np.full((len(self.motorNames), len(self.blockNames), len(self.objectives)), np.nan)
+        raw = []
+        for m, motor in enumerate(self.motorNames):
+            am = rm.get(motor, rm.get('*',{}))
+            raw.append([am.get(block, am.get('*',0.0)) for block in self.blockNames])
+            for b, r in enumerate(raw[m]):
+                rewards[m, b] = self.objectiveSpace.reward(r)
+        rewards.flags.writeable = False
+        return rewards, raw
+
+    # The reward vector of motor in block, both are codes. The rewards are
+    # compiled again if new motors or blocks has been added since.
+    def reward(self, motor, block):
+        if motor >= self.rewards.shape[0] or block >= self.rewards.shape[1]:
+            self.compile()
+        return self.rewards[motor, block]
+
+    # The reward vector of motor in block over objectives, a scalar reward
+    # is given to all of them
+    def objectiveReward(self, motor, block, objectives):
+        reward = self.reward(motor, block)
+        if objectives.names == self.objectiveSpace.names:
+            return reward
+        return objectives.reward(self.rawRewards[motor][block])
+
+    # The block code that every [motor x block] is transformed to, -1 when
+    # the block isn't transformed
+    def _compileTransforms(self):
+        transforms = np.full((len(self.motorNames), len(self.blockNames)), -1, dtype=np.int32)
+        for motor, tm in self.transform.items():
+            for block, target in tm.items():
+                if target: transforms[self.motorCode(motor), self.blockCode(block)] = self.blockCode(target)
+        return transforms
+
+    def transformed(self, motor, block):
+        if motor >= self.transforms.shape[0] or block >= self.transforms.shape[1]:
+            self.compile()
+        return self.transforms[motor, block]
+
 class Environment(agents.Environment):
     def __init__(self, config=None, objectives=None, wss=None, fieldConfig=None):
         super().__init__()
@@ -77,7 +181,11 @@ class Environment(agents.Environment):
         self.fieldConfig = fieldConfig
         self.config = config
         self.world = config.world
+        # The (x, y) of the cells that has been changed during the last step
+        self.dirtyCells = set()
         self.objectives = objectives or config.objectives
+        self._perceptions = {}
+        self._perceptionKeys = {}
         if self.config.enable_playback:
             self.playback = open( os.path.join(config.outputPath, "playback_script.py"), "w")
             print("import turtle;t = turtle.Turtle()", file=self.playback)
@@ -105,20 +213,161 @@ class Environment(agents.Environment):
                 print("t.color((0,0,1));t.dot(5);t.color((0,0,0))", file=self.playback)
 
     def getHeight(self):
-        return len(self.world)
+        return self.world.shape[0]
 
     def getWidth(self):
-        return len(self.world[0])
+        return self.world.shape[1]
 
     def currentCell(self, agent, delta=(0,0)):
-        y = (agent.position[1]+delta[1]) % len(self.world)
-        x = (agent.position[0]+delta[0]) % len(self.world[y])
-        return self.world[y][x]
+        return self.config.blockNames[self._currentCode(agent, delta)]
+
+    def _currentCode(self, agent, delta=(0,0)):
+        height, width = self.world.shape
+        return self.world[(agent.position[1]+delta[1]) % height, (agent.position[0]+delta[0]) % width]
 
     def setCurrentCell(self, agent, v):
-        y = agent.position[1] % len(self.world)
-        x = agent.position[0] % len(self.world[y])
-        self.world[y][x] = v
+        code = self.config.blockCode(v)
+        if code > np.iinfo(self.world.dtype).max:
+            self.world = self.config.world = self.world.astype(np.uint16)
+        self._setCurrentCode(agent, code)
+
+    def _setCurrentCode(self, agent, code):
+        height, width = self.world.shape
+        x, y = agent.position[0] % width, agent.position[1] % height
+        self.world[y, x] = code
+        self.dirtyCells.add((x, y))
+
+    def step(self):
+        self.dirtyCells = set()
+        if self.config.batched:
+            self._batchStep()
+        else:
+            super().step()
+
+    # Step all agents at once, the percepts, moves, rewards and transforms
+    # are array operations over the agents. Only the networks are ticked and
+    # learn one agent at a time. Every agent sees the world as it was at the
+    # start of the step, when several agents transform the same cell the
+    # first one wins. There is no playback or viewer updates in this mode,
+    # use dirtyCells.
+    def _batchStep(self):
+        if self.is_done(): return
+        agents = [agent for agent in self.agents if agent.alive]
+        if not agents: return
+        height, width = self.world.shape
+        position = np.array([agent.position for agent in agents], dtype=np.int64)
+        blocks = self.world[position[:,1] % height, position[:,0] % width]
+
+        # Agents with the same sensors sense the world together
+        perceptions = [self._perception(agent.network) for agent in agents]
+        groups = {}
+        for i, perception in enumerate(perceptions):
+            groups.setdefault(id(perception), []).append(i)
+        masks = [0]*len(agents)
+        for rows in groups.values():
+            for i, mask in zip(rows, self._senseMasks([agents[i] for i in rows], perceptions[rows[0]])):
+                masks[i] = mask
+
+        actions = []
+        for agent, mask in zip(agents, masks):
+            agent.network.tickSensors(mask)
+            actions.append(agent.program(None))
+        debug('_batchStep - actions:', len(actions))
+
+        # Agents without an action stay where they are
+        acting = [i for i, action in enumerate(actions) if action[0]]
+        if len(acting) < len(agents):
+            agents, actions = [agents[i] for i in acting], [actions[i] for i in acting]
+            position, blocks = position[acting], blocks[acting]
+            if not agents:
+                self.exogenous_change()
+                return
+
+        motors = np.array([self.config.motorCode(action[0]) for action in actions], dtype=np.int64)
+        if not self.config.isCompiled(): self.config.compile()
+        rewards = self.config.rewards[motors, blocks]
+        rewards.flags.writeable = False
+
+        # Move and turn
+        orientation = np.array([agent.orientation for agent in agents], dtype=np.int64)
+        moves = self.config.moves[motors]
+        delta = self.config.orientations[(orientation + moves) % 8]
+        x, y = position[:,0] + delta[:,0], position[:,1] + delta[:,1]
+        if self.config.is_torus:
+            x, y = x % width, y % height
+        moved = (moves >= 0) & (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        position[moved] = np.stack([x, y], axis=1)[moved]
+        orientation = (orientation + self.config.turns[motors]) % 8
+
+        # Transform the blocks the agents acted on, at their new positions
+        targets = self.config.transforms[motors, blocks]
+        x, y = position[:,0] % width, position[:,1] % height
+        changed = np.nonzero(targets >= 0)[0]
+        _, first = np.unique((y*width + x)[changed], return_index=True)
+        changed = changed[first]
+        self.world[y[changed], x[changed]] = targets[changed]
+        self.dirtyCells.update(zip(x[changed].tolist(), y[changed].tolist()))
+
+        for agent, p, o in zip(agents, position.tolist(), orientation.tolist()):
+            agent.position = tuple(p)
+            agent.orientation = o
+        for agent, action, reward, motor, block in zip(agents, actions, rewards, motors.tolist(), blocks.tolist()):
+            space = agent.network.objectiveSpace
+            if space.names != self.config.objectiveSpace.names:
+                reward = self.config.objectiveReward(motor, block, space)
+            agent.takeAction(action, reward)
+        self.exogenous_change()
+
+    # How network senses the world, the world offsets of the cells in its
+    # field of view for every orientation, and for every cell a table of the
+    # active sensors for every block code, as bitmasks over the node ids.
+    # The last code is for cells outside of the world. Networks with the
+    # same sensors share the perception.
+    def _perception(self, network):
+        key = self._perceptionKeys.get(network)
+        if key is None:
+            key = (repr(network.config.field_of_view), tuple([(x.name, x.n_id) for x in network.sensors if x.sense is None]))
+            self._perceptionKeys[network] = key
+        perception = self._perceptions.get(key)
+        if perception is None or len(perception[1][0]) <= len(self.config.blockNames):
+            fieldOfView = FieldOfView.fromConfig(network.config.field_of_view)
+            slots = {slot:i for i,slot in enumerate(fieldOfView.slots())}
+            tables = [[0]*(len(self.config.blockNames) + 1) for _ in slots]
+            for x in network.sensors:
+                name, slot = parseSensorName(x.name[1:])
+                if x.sense is not None or slot not in slots: continue
+                table = tables[slots[slot]]
+                for code, block in enumerate(self.config.blockNames):
+                    if self.config.blocks.get(block, {}).get(name, 0):
+                        table[code] = table[code] | 1 << x.n_id
+            perception = (fieldOfView.offsets(self.config.orientations), tables)
+            self._perceptions[key] = perception
+        return perception
+
+    # The active sensors of agents as bitmasks. The cells in the field of
+    # view of all agents are read in one gather, cells outside of a world
+    # that isn't a torus are empty.
+    def _senseMasks(self, agents, perception, delta=(0,0)):
+        offsets, tables = perception
+        height, width = self.world.shape
+        position = np.array([agent.position for agent in agents], dtype=np.int64).reshape(-1, 2) + delta
+        if len(tables) == 1:
+            return [tables[0][code] for code in self.world[position[:,1] % height, position[:,0] % width].tolist()]
+
+        orientation = np.array([agent.orientation for agent in agents], dtype=np.int64) % 8
+        cells = position[:,None,:] + offsets[orientation]
+        x, y = cells[:,:,0], cells[:,:,1]
+        codes = self.world[y % height, x % width]
+        if not self.config.is_torus:
+            outside = (x < 0) | (x >= width) | (y < 0) | (y >= height)
+            codes = np.where(outside, len(tables[0]) - 1, codes)
+        masks = []
+        for row in codes.tolist():
+            mask = 0
+            for table, code in zip(tables, row):
+                mask = mask | table[code]
+            masks.append(mask)
+        return masks
 
     # Updates the sensors, does not return a percept
     def percept(self, agent, delta=(0,0)):
@@ -126,22 +375,20 @@ class Environment(agents.Environment):
         #things = self.list_things_at(agent.location)
         #return things
 
-        y = (agent.position[1]+delta[1]) % len(self.world)
-        x = (agent.position[0]+delta[0]) % len(self.world[y])
-        cell = self.world[y][x]
-
-        observation = self.config.blocks.get(cell,{})
-
-        debug('--------------\npercept - cell:' + cell + ", observation:" + str(observation))
-        agent.network.tick(observation)
+        perception = self._perception(agent.network)
+        if len(perception[1]) == 1:
+            code = self._currentCode(agent, delta)
+            if DEBUG_MODE: debug('--------------\npercept - cell:' + self.config.blockNames[code] + ", observation:" + str(self.config.blocks.get(self.config.blockNames[code],{})))
+            agent.network.tickSensors(perception[1][0][code])
+        else:
+            agent.network.tickSensors(self._senseMasks([agent], perception, delta)[0])
 
         return None
 
-    def _getReward(self, action, cell, status):
-        rm = self.config.rewardMatrix
-        am = rm.get(action, rm.get('*',{}))
-        r = am.get(cell, am.get('*',0.0))
-        reward = makeRewardDict(r, status)
+    # The reward of motor in block as a vector over objectives, the vectors
+    # are shared and can't be changed
+    def _getReward(self, motor, block, objectives):
+        reward = self.config.objectiveReward(motor, block, objectives)
         # TODO: truncate reward if need is satisfied
         return reward
 
@@ -155,8 +402,10 @@ class Environment(agents.Environment):
 
 
     def takeAction(self, agent, action):
-        cell = self.currentCell(agent)
-        reward = self._getReward(action, cell, agent.needs)
+        if not action: return None
+        motor = self.config.motorCode(action)
+        block = self._currentCode(agent)
+        reward = self._getReward(motor, block, agent.network.objectiveSpace)
         debug("takeAction - reward:", reward, ", position:", agent.position, ", action:", action, ", wss:", self.wss)
 
         def move_agent(agent, dx, dy):
@@ -202,13 +451,13 @@ class Environment(agents.Environment):
             if self.wss is not None:
                 self.wss.send_print_message('Agent ' + agent.name + ' drank')
 
-        trans = self.config.transform.get(action,{}).get(cell, None)
-        if trans:
-            debug("takeAction - *** transform action:", action, ", cell:", cell, ", trans", trans)
-            self.setCurrentCell(agent, trans)
+        trans = self.config.transformed(motor, block)
+        if trans >= 0:
+            if DEBUG_MODE: debug("takeAction - *** transform action:", action, ", cell:", self.config.blockNames[block], ", trans", self.config.blockNames[trans])
+            self._setCurrentCode(agent, trans)
 
         return reward
 
     def printWorld(self):
-        for row in self.world:
-            debug(row)
+        for row in self.world.tolist():
+            debug([self.config.blockNames[x] for x in row])
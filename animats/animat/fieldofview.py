@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+#    pyAnimat - Simulate Animats using Transparent Graphs as a way to AGI
+#    Copyright (C) 2017  Nils Svangård, Claes Strannegård
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+
+
+# Setup logging
+# =============
+
+DEBUG_MODE = False
+
+def debug(*args):
+    if DEBUG_MODE: print('DEBUG:fieldofview:', *args)
+
+def error(*args):
+    print('ERROR:fieldofview:', *args)
+
+def warn(*args):
+    print('WARNING:fieldofview:', *args)
+
+
+# The code
+# ========
+
+SHAPES = ['square', 'cone']
+
+# The cells an agent senses around it. A square sees the cells within
+# radius in x and y, the slots are the (dx, dy) offsets. A cone looks in
+# the orientation of the agent, the slots are (distance, side) where side
+# goes from -distance to distance, left to right. The cells at a distance
+# are on the ring around the agent, side steps from the heading towards the
+# headings 45 degrees to the left and right, so diagonal cones are as
+# symmetric as the straight ones. Both see the cell the agent stands on
+# first, slot (0, 0).
+#
+# A sensor k of slot (a, b) is named k@a,b, sensors of slot (0, 0) keep
+# their name.
+class FieldOfView:
+    def __init__(self, shape='square', radius=1):
+        if shape not in SHAPES:
+            raise ValueError("unknown field of view shape %s" % shape)
+        self.shape = shape
+        self.radius = radius
+
+    @staticmethod
+    def fromConfig(conf):
+        if not conf: return FieldOfView('square', 0)
+        return FieldOfView(conf.get("shape", "square"), conf.get("radius", 1))
+
+    def slots(self):
+        r = self.radius
+        if self.shape == 'square':
+            return [(0, 0)] + [(dx, dy) for dy in range(-r, r+1) for dx in range(-r, r+1) if (dx, dy) != (0, 0)]
+        return [(0, 0)] + [(d, side) for d in range(1, r+1) for side in range(-d, d+1)]
+
+    # The world offsets of the slots for every orientation as an
+    # [orientation x slot x 2] array, orientations is the ORIENTATION_MATRIX
+    def offsets(self, orientations):
+        slots = np.array(self.slots(), dtype=np.int64).reshape(-1, 2)
+        if self.shape == 'square':
+            return np.repeat(slots[None,:,:], len(orientations), axis=0)
+        orientations = np.array(orientations, dtype=np.int64)
+        forward = orientations[:,None,:]
+        left = np.roll(orientations, 1, axis=0)[:,None,:] - forward
+        right = np.roll(orientations, -1, axis=0)[:,None,:] - forward
+        distance, side = slots[None,:,0,None], slots[None,:,1,None]
+        return distance*forward + np.maximum(-side, 0)*left + np.maximum(side, 0)*right
+
+    def sensorNames(self, sensors):
+        return [sensorName(k, slot) for slot in self.slots() for k in sensors]
+
+
+def sensorName(key, slot):
+    if slot == (0, 0): return key
+    return "%s@%d,%d" % ((key,) + tuple(slot))
+
+# The observation key and slot of a sensor name, without the $. Names
+# without a slot are of slot (0, 0).
+def parseSensorName(name):
+    key, at, slot = name.rpartition('@')
+    try:
+        a, b = slot.split(',')
+        return (key, (int(a), int(b)))
+    except ValueError:
+        return (name, (0, 0))
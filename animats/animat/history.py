@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+#    pyAnimat - Simulate Animats using Transparent Graphs as a way to AGI
+#    Copyright (C) 2017  Nils Svangård, Claes Strannegård
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import sys
+
+import numpy as np
+
+
+# Setup logging
+# =============
+
+DEBUG_MODE = False
+
+def debug(*args):
+    if DEBUG_MODE: print('DEBUG:history:', *args)
+
+def error(*args):
+    print('ERROR:history:', *args)
+
+def warn(*args):
+    print('WARNING:history:', *args)
+
+
+# The code
+# ========
+
+# The last capacity rewards, kept in a [capacity x objective] array that is
+# written as a ring. The array is allocated on the first append, most nodes
+# and actions never get a reward. Objectives missing from a reward are
+# recorded as 0.
+class RewardHistory:
+    __slots__ = ('objectives', 'capacity', 'values', 'size', 'next')
+
+    def __init__(self, objectives, capacity):
+        self.objectives = objectives
+        self.capacity = capacity
+        self.values = None
+        self.size = 0
+        self.next = 0
+
+    def __str__(self):
+        return str(list(self))
+
+    def __len__(self):
+        return self.size
+
+    # The rewards as dicts, the oldest first
+    def __iter__(self):
+        start = self.next - self.size
+        for i in range(start, self.next):
+            yield dict(zip(self.objectives, self.values[i % self.capacity].tolist()))
+
+    def append(self, reward):
+        if self.capacity == 0: return
+        if self.values is None:
+            self.values = np.zeros((self.capacity, len(self.objectives)))
+        self.values[self.next] = [reward.get(k, 0.0) for k in self.objectives]
+        self.next = (self.next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    # The recorded rewards as a view of the array, not in time order
+    def window(self):
+        if self.values is None: return np.zeros((0, len(self.objectives)))
+        return self.values[:self.size]
+
+    def mean(self, objective=None):
+        return self._stat(np.mean, objective)
+
+    def var(self, objective=None):
+        return self._stat(np.var, objective)
+
+    def min(self, objective=None):
+        return self._stat(np.min, objective)
+
+    def max(self, objective=None):
+        return self._stat(np.max, objective)
+
+    # func over the window per objective, 0 when the history is empty
+    def _stat(self, func, objective):
+        if self.size == 0:
+            values = np.zeros(len(self.objectives))
+        else:
+            values = func(self.window(), axis=0)
+        if objective:
+            if objective not in self.objectives: return 0.0
+            return float(values[self.objectives.index(objective)])
+        return dict(zip(self.objectives, values.tolist()))
+
+    def sizeof(self):
+        return sys.getsizeof(self) + (0 if self.values is None else self.values.nbytes)
@@ -21,6 +21,8 @@
 #    several agents, fixed logging etc.
 
 class Motor:
+    __slots__ = ('name', 'trigger')
+
     def __init__(self, name, trigger=None):
         self.name = name
         self.trigger = trigger
@@ -17,11 +17,16 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import heapq
 import random
 import pprint
 
+from collections import OrderedDict
+
 from . import node
 from .action import *
+from .history import RewardHistory
+from .objectives import Objectives
 
 
 # Setup logging
@@ -46,6 +51,13 @@ def warn(*args):
 # The code
 # ========
 
+# The node ids of the set bits in mask, in increasing order
+def bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask = mask ^ low
+
 def oneSum(a,b):
     return min(1, max(-1, a+b))
 
@@ -117,20 +129,61 @@ class NetworkConfig:
         self.reward_learning_factor = conf.get("reward_learning_factor", 0.5)
         self.sensors = conf.get("sensors", "rgb0")
         self.motors = conf.get("motors", ["left", "right", "up", "down", "eat", "drink"])
+        self.action_store = conf.get("action_store", "dict")
+        self.decision_memo_size = conf.get("decision_memo_size", 0)
+        self.decision_memo_grid = conf.get("decision_memo_grid", 0.05)
+        self.field_of_view = conf.get("field_of_view", None)
 
 class Network:
     def __init__(self, config, sensors, motors, objectives, seed=0):
         self.config = config
         self.time = 0
         self.node_count = 0
+        self.action_count = 0
         self.nodes = {}
         self.actions = {}
+        self._registry = {}
+        self._names = {}
+        self._unnamed = set()
         self.sensors = sensors
         self.motors = motors
         self.objectives = objectives
+        self.objectiveSpace = Objectives(objectives)
+        self.objectiveOrder = self.objectiveSpace.names
         self.lastChange = self.time
+        self._dirty = set()
+        self._topologyChanged = False
+
+        # The activation state of the nodes as bitmasks over the node ids,
+        # kept in sync with the flags on the nodes.
+        self._active = 0
+        self._previous = 0
+        self._pending = 0
+        self._topActive = 0
+        self._sensorMask = 0
+        self._reachable = None
+
+        self._topNodes = set()
+        self._virtualNodes = set()
+        self._activeVirtualNodes = set()
+        self._nodelessActions = []
+        self._availableActions = None
+        self._availableByMotor = None
+        self._motorQ = {}
+        self._actionsVersion = 0
+        self._decision = None
+        self.decisionHits = 0
+        self.decisionMisses = 0
+        self._memo = OrderedDict() if config.decision_memo_size > 0 else None
+        self._qClock = 0
+        self._qUpdated = {}
+        self.memoHits = 0
+        self.memoMisses = 0
         self._utilityFunc = UTILITY_FUNCTIONS.get(config.utility_function)
         self._qFunc = Q_FUNCTIONS.get(config.q_function)
+        self._store = None
+        if config.action_store == "columnar":
+            self._store = ActionStore(objectives)
         self.addNodes(sensors)
 
         # TODO: get predictable and testable results, should be moved to config
@@ -138,7 +191,7 @@ class Network:
             random.seed(seed)
 
     def __str__(self):
-        return ("Network - nodes:" + str([n for n in self.nodes]) +
+        return ("Network - nodes:" + str([n.getName() for n in self.nodes.values()]) +
                ", actions:" + str([str(k)+":"+str(v) for k,v in self.actions]) +
                ", sensors:" + str([str(x) for x in self.sensors]) + ", motors:" +
                str([str(x) for x in self.motors]) + ", objectives:" + str(self.objectives))
@@ -147,58 +200,208 @@ class Network:
     def getNodeCount(self): return self.node_count
 
     # JC, Added observation which is supplied by Environment.percept
+    #
+    # Only the nodes downstream of a changed sensor (or of a node added since
+    # the last tick) are evaluated. The other nodes would evaluate to the same
+    # state again, so when the active sensors are unchanged the tick is skipped.
     def tick(self, observation=None):
         self.time = self.time + 1
-        self._previousSensors = self.activeSensors()
-        for node in self.sensors:
-            node.tick(self.time, observation)
-        if self._previousSensors != self.activeSensors():
-            self.sensorsChanged = True
-            self._setPreviousActive()
-        self._propagate() # Tick each node, depth first
-        self._findTopActive()
-
-    def _setPreviousActive(self):
-        for node in list(self.nodes.values()):
-            node.previousActive = node.pendingPreviousActive
-
-    def _propagate(self):
-        for node in self.topNodes(includeVirtual=True):
-            node.tick(self.time)
+        self._tick([node.evaluate(observation, self.time) for node in self.sensors])
 
+    # Like tick, with the observation as a bitmask over the ids of the
+    # sensors. Sensors with a sense function still use it.
+    def tickSensors(self, mask):
+        self.time = self.time + 1
+        self._tick([mask >> node.n_id & 1 == 1 if node.sense is None else node.evaluate(None, self.time) for node in self.sensors])
+
+    def _tick(self, sensors):
+        active = self._active
+        for node, value in zip(self.sensors, sensors):
+            self._evaluate(node, value)
+        changed = (active ^ self._active) & self._sensorMask
+        dirty, self._dirty = self._dirty, set()
+        if changed:
+            self.sensorsChanged = True
+            # The sensors have been evaluated, the other nodes haven't
+            sensors = self._sensorMask
+            dirty.update(self._setPreviousActive((self._pending & ~sensors) | (active & sensors)))
+            for i in bits(changed):
+                dirty.update(self.nodes[i].outputs)
+
+        # Every node is evaluated on every tick, so the pending state is the
+        # state at the start of the tick.
+        for i in bits(self._pending ^ active):
+            self.nodes[i].pendingPreviousActive = active >> i & 1 == 1
+        self._pending = active
+
+        flips = self._propagate(dirty)
+        if changed or flips:
+            self._topologyChanged = True
+        self.updateTopActive()
+
+    # Find the top-active nodes again if the activations or the topology has
+    # changed, e.g. after nodes has been deleted between ticks.
+    def updateTopActive(self):
+        if self._topologyChanged:
+            self._findTopActive()
+            self._topologyChanged = False
+
+    # Set the activation of node, returns True if it changed
+    def _evaluate(self, node, active):
+        changed = node.active != active
+        node._setActive(self.time, active)
+        node._propagated = True
+        if changed:
+            self._active = self._active ^ (1 << node.n_id)
+            if node.virtual: self._indexNode(node)
+        return changed
+
+    # Set the previous state of all nodes to the bitmask previous, only the
+    # nodes where it changed are visited. Returns the nodes that has to be
+    # evaluated due to the new state.
+    def _setPreviousActive(self, previous):
+        dirty = set()
+        for i in bits(self._previous ^ previous):
+            node = self.nodes[i]
+            node.previousActive = previous >> i & 1 == 1
+            dirty.update(node.outputs)
+        self._previous = previous
+        return dirty
+
+    # Evaluate the dirty nodes and the nodes downstream of those that changed,
+    # in topological order. Nodes are always added after their inputs, so the
+    # node ids are a topological order. Nodes that aren't in the network are
+    # skipped. Returns the number of changed nodes.
+    def _propagate(self, dirty):
+        flips = 0
+        queued = set([node for node in dirty if node.network is self])
+        queue = [(node.n_id, node) for node in queued]
+        heapq.heapify(queue)
+        while queue:
+            _, node = heapq.heappop(queue)
+            if self._evaluate(node, node.evaluate()):
+                flips = flips + 1
+                for output in node.outputs:
+                    if output not in queued and output.network is self:
+                        queued.add(output)
+                        heapq.heappush(queue, (output.n_id, output))
+        return flips
+
+    # A node is top-active when it's active and no node above it (through
+    # real outputs) is active. Only nodes that can be reached from the sensors
+    # through real outputs are considered.
+    #
+    # Each node is visited once, first in topological order to find the
+    # reachable nodes, then in reverse order to find the active nodes above.
     def _findTopActive(self, verbose=False):
-        for node in list(self.nodes.values()):
-            node.topActive = False
-        for node in self.sensors:
-            node._findTopActive(verbose)
+        reachable = self._reachableMask()
+        for i in bits(self._topActive):
+            self.nodes[i].topActive = False
+        self._topActive = 0
+        activeAbove = set()
+        for node in reversed(list(self.nodes.values())):
+            above = False
+            for output in node.outputs:
+                if output in activeAbove and not output.isVirtual():
+                    above = True
+                    break
+            if above or node.active:
+                activeAbove.add(node)
+            if node.active and not above and reachable >> node.n_id & 1:
+                node.topActive = True
+                self._topActive = self._topActive | (1 << node.n_id)
+        if verbose: debug("_findTopActive - top active:", [x.getName() for x in self.activeTopNodes()])
+        self._availableActions = None
+
+    # The reachable nodes only change with the topology, they are found
+    # again after a real node has been added or deleted.
+    def _reachableMask(self):
+        if self._reachable is None:
+            reachable = self._sensorMask
+            for node in self.nodes.values():
+                if not reachable >> node.n_id & 1 and not node.isVirtual():
+                    for i in node.inputs:
+                        if i.n_id is not None and reachable >> i.n_id & 1:
+                            reachable = reachable | (1 << node.n_id)
+                            break
+            self._reachable = reachable
+        return self._reachable
+
+    # Update the top and virtual node indexes, called when the outputs,
+    # virtual flag or activation of node changes.
+    def _indexNode(self, node):
+        if self.nodes.get(node.n_id) is not node: return
+        if (node in self._virtualNodes) != node.isVirtual():
+            self._reachable = None
+        self._updateIndex(self._topNodes, node, node.isTopNode(True))
+        self._updateIndex(self._virtualNodes, node, node.isVirtual())
+        self._updateIndex(self._activeVirtualNodes, node, node.isVirtual() and node.isActive())
+        self._topologyChanged = True
+        self._availableActions = None
+
+    def _updateIndex(self, index, node, member):
+        if member:
+            index.add(node)
+        else:
+            index.discard(node)
+
+    # The indexes are sets, return the nodes in the order they were added
+    def _inOrder(self, nodes):
+        return sorted(nodes, key=lambda x: x.n_id)
 
     def activeSensors(self):
         return [x for x in self.sensors if x.active]
 
+    # The active sensors as a bitmask over the node ids
+    def activeSensorMask(self):
+        return self._active & self._sensorMask
+
     def allNodes(self):
         return list(self.nodes.values())
 
     def topNodes(self, includeVirtual=False):
-        return [x for x in list(self.nodes.values()) if x.isTopNode(includeVirtual)]
+        return self._inOrder([x for x in self._topNodes if includeVirtual or not x.isVirtual()])
 
     def activeTopNodes(self, includeVirtual=False):
-        return [x for x in list(self.nodes.values()) if x.isTopActive(includeVirtual)]
+        return [self.nodes[i] for i in bits(self._topActive) if self.nodes[i].isTopActive(includeVirtual)]
 
     def virtualNodes(self):
-        return [x for x in list(self.nodes.values()) if x.isVirtual()]
+        return self._inOrder(self._virtualNodes)
 
     def activeVirtualNodes(self):
-        return [x for x in self.virtualNodes() if x.isActive()]
+        return self._inOrder(self._activeVirtualNodes)
 
     def addNodes(self, nodes):
         for node in nodes:
             self.addNode(node)
 
     def addNode(self, node):
-        if self.hasNode(node): return False
-        self.nodes[node.getName()] = node
+        if self.hasNode(node):
+            # A rejected duplicate is not an output of its inputs
+            if node.network is None:
+                for i in dict.fromkeys(node.inputs):
+                    i.removeOutput(node)
+            return False
         self.node_count = self.node_count + 1
         node.setNetwork(self)
+        self.nodes[node.n_id] = node
+        self._registry[node.getKey()] = node
+        if node._name is not None:
+            self._names[node._name] = node
+        else:
+            self._unnamed.add(node)
+        self._indexAncestors(node)
+        bit = 1 << node.n_id
+        if node.active: self._active = self._active | bit
+        if node.previousActive: self._previous = self._previous | bit
+        if node.pendingPreviousActive: self._pending = self._pending | bit
+        if node in self.sensors:
+            self._sensorMask = self._sensorMask | bit
+        else:
+            self._dirty.add(node)
+        if not node.isVirtual():
+            self._reachable = None
+        self._indexNode(node)
         self.lastChange = self.time
         return True
 
@@ -206,34 +409,97 @@ class Network:
         # Can only delete top-nodes
         if node.permanent: return False
         if node.isTopNode() != True: return False
-        for i in node.inputs:
-            i.outputs.remove(node)
-        del self.nodes[node.name]
+        # The same node can be used twice as input, e.g. SEQ(a, a)
+        for i in dict.fromkeys(node.inputs):
+            i.removeOutput(node)
+        for action in node.actions:
+            self.actions.pop((node.getId(), action.motor), None)
+            if self._store is not None:
+                self._store.release(action.row)
+                action.row = None
+        del self.nodes[node.n_id]
+        self._qUpdated.pop(node.n_id, None)
+        del self._registry[node.getKey()]
+        if self._names.get(node._name) is node:
+            del self._names[node._name]
+        self._unnamed.discard(node)
+        node._ancestors = None
+        for index in [self._dirty, self._topNodes, self._virtualNodes, self._activeVirtualNodes]:
+            index.discard(node)
+        mask = ~(1 << node.n_id)
+        self._active = self._active & mask
+        self._previous = self._previous & mask
+        self._pending = self._pending & mask
+        self._topActive = self._topActive & mask
+        self._sensorMask = self._sensorMask & mask
+        self._reachable = None
+        node.topActive = False
+        self._topologyChanged = True
+        self._availableActions = None
         self.lastChange = self.time
         return True
 
+    # The ancestors of a node (itself and all nodes below it) are kept as a
+    # bitset over the node ids. Inputs are added before their outputs, so the
+    # ancestors of the inputs are already known. Nodes with inputs outside of
+    # the network are not indexed.
+    def _indexAncestors(self, node):
+        ancestors = 1 << node.n_id
+        for i in node.inputs:
+            if i._ancestors is None or i.network is not self:
+                node._ancestors = None
+                return
+            ancestors = ancestors | i._ancestors
+        node._ancestors = ancestors
+
+    # Called by Node when its name has been built
+    def _nameBuilt(self, node):
+        if self.nodes.get(node.n_id) is node:
+            self._names[node.getName()] = node
+            self._unnamed.discard(node)
+
     def findNode(self, name):
-        return self.nodes.get(name, None)
+        if name not in self._names:
+            # Build the names that are still missing
+            for x in list(self._unnamed):
+                x.getName()
+        return self._names.get(name, None)
+
+    def findNodeByKey(self, key):
+        return self._registry.get(key, None)
 
     def hasAndNode(self, inputs):
-        return self.hasNode(node.makeName("AND", inputs))
+        return self._hasStructure("AND", inputs, True)
 
     def hasSeqNode(self, inputs):
-        return self.hasNode(node.makeName("SEQ", inputs, False))
+        return self._hasStructure("SEQ", inputs, False)
+
+    def _hasStructure(self, kind, inputs, sort):
+        if any(x.n_id is None for x in inputs):
+            return self.hasNode(node.makeName(kind, inputs, sort))
+        return self.findNodeByKey(node.makeKey(kind, inputs, sort)) != None
 
     def hasNode(self, node):
         if type(node) == str or type(node) == str:
             return self.findNode(node) != None
         else:
-            return self.findNode(node.getName()) != None
+            return self.findNodeByKey(node.getKey()) != None
 
     def createAction(self, node, motor, reward=None):
         actionId = (node.getId(), motor)
         if actionId in self.actions:
             return self.actions[actionId]
         else:
-            action = Action(self, node, motor, reward)
+            if self._store is not None:
+                action = ColumnarAction(self, node, motor, reward)
+            else:
+                action = Action(self, node, motor, reward)
+            self.action_count = self.action_count + 1
+            action.a_id = self.action_count
             self.actions[actionId] = action
+            if node is None:
+                self._nodelessActions.append(action)
+            self._availableActions = None
             return action
 
     def knownActions(self, objective=None):
@@ -244,7 +510,26 @@ class Network:
         return sorted(actions, key=lambda x: -x[0])
 
     def availableActions(self):
-        return [a for a in list(self.actions.values()) if a.isAvailable()]
+        self._updateAvailableActions()
+        return self._availableActions
+
+    # Available actions grouped by motor name, in the order they were created
+    def availableActionsByMotor(self):
+        self._updateAvailableActions()
+        return self._availableByMotor
+
+    # The available actions only change with the top-active nodes, rebuild the
+    # buckets the first time they are needed after a change.
+    def _updateAvailableActions(self):
+        if self._availableActions is not None: return
+        self._actionsVersion = self._actionsVersion + 1
+        actions = [a for i in bits(self._topActive) if self.nodes[i].isTopActive() for a in self.nodes[i].actions]
+        actions = sorted(actions + self._nodelessActions, key=lambda x: x.a_id)
+        self._availableActions = actions
+        self._motorQ = {}
+        self._availableByMotor = {motor.name:[] for motor in self.motors}
+        for action in actions:
+            self._availableByMotor.setdefault(action.motor.name, []).append(action)
 
     def evaluateActionUtility(self, actionQ, status):
         newQ = {objective:self._qFunc(Q, status) for objective,Q in list(actionQ.items())}
@@ -252,46 +537,58 @@ class Network:
         return self._utilityFunc( newQ, status)
 
     def predictR(self, motor):
-        R = { k:0.0 for k in self.objectives }
+        R, N = self.predictRVector(motor)
+        return self.objectiveSpace.dict(R), N
+
+    # The mean expected reward of the available actions for motor, as a
+    # vector over the objectives
+    def predictRVector(self, motor):
+        R = self.objectiveSpace.zeros()
         C = 0.0
         N = 0
-        for action in self.availableActions():
-            if action.motor.name == motor:
-                C = C + 1
-                N = N + action.triggers
-                for objective in self.objectives:
-                    R[objective] = R[objective] + action.getR(objective)
-
-        debug("predictR - res:", {k:v/C for k,v in list(R.items())}, N)
-        return {k:v/C for k,v in list(R.items())}, N
-
-    def getBestAction(self, status, epsilon=None):
-        actions = {motor.name:[] for motor in self.motors}
-        for action in self.availableActions():
-            actions[action.motor.name].append(action)
-        debug("getBestAction - actions:", str([x for x in actions]))
-
-
-        actions_objective = {}
+        for action in self.availableActionsByMotor().get(motor, []):
+            C = C + 1
+            N = N + action.triggers
+            R = R + [action.getR(objective) for objective in self.objectiveOrder]
+
+        debug("predictRVector - res:", R/C, N)
+        return R/C, N
+
+    def _aggregateQ(self, actions):
+        if self._store is not None:
+            return self._store.aggregateQ([action.row for action in actions])
+
+        actionsQ = {}
+        for obj in self.objectives:
+            actionsQ[obj] = {
+                'min': min([action.getMinQ(obj) for action in actions]),
+                'max': max([action.getMaxQ(obj) for action in actions]),
+                'mean': mean([action.getQ(obj) for action in actions]),
+                'weighted': weightedMean([(action.getQ(obj),action.triggers) for action in actions]),
+            }
+        return actionsQ
+
+    # Q aggregates of the available actions for each motor. They are kept
+    # until the available actions change, or one of them is updated.
+    def motorQ(self):
+        actions = self.availableActionsByMotor()
         for motor,v in list(actions.items()):
-            actionsQ = {}
-            actions_objective[motor] = actionsQ
-            for obj in self.objectives:
-                actionsQ[obj] = {
-                    'min': min([action.getMinQ(obj) for action in v]),
-                    'max': max([action.getMaxQ(obj) for action in v]),
-                    'mean': mean([action.getQ(obj) for action in v]),
-                    'weighted': weightedMean([(action.getQ(obj),action.triggers) for action in v]),
-                }
-
-        debug("getBestAction - => OBJECTIVE_ACTIONS", actions_objective)
+            if motor not in self._motorQ:
+                self._motorQ[motor] = self._aggregateQ(v)
+        return {motor:self._motorQ[motor] for motor in actions}
+
+    # Called by Action.updateQ
+    def _actionUpdated(self, action):
+        if self._memo is not None:
+            self._qClock = self._qClock + 1
+            self._qUpdated[action.node.n_id if action.node else None] = self._qClock
+        if action.isAvailable():
+            self._actionsVersion = self._actionsVersion + 1
+            self._motorQ.pop(action.motor.name, None)
 
-        actions = []
-        for action, v in list(actions_objective.items()):
-            actions.append((self.evaluateActionUtility(v, status), action, v))
+    def getBestAction(self, status, epsilon=None):
+        actions = self._rankActions(status)
 
-        actions = sorted(actions, key=lambda x:-x[0])
-        debug("getBestAction - DECIDE", actions)
 
         # Shouldn't really happend, unless the network is empty
         if len(actions) == 0:
@@ -307,8 +604,95 @@ class Network:
 
         return bestAction
 
+    # The motors ranked by utility given status, the best first. The ranking
+    # is kept until the time, status or the available actions change, so
+    # that several decisions in the same tick only rank the motors once.
+    def _rankActions(self, status):
+        self._updateAvailableActions()
+        key = (self.time, self._actionsVersion, tuple(status.items()))
+        if self._decision is not None and self._decision[0] == key:
+            self.decisionHits = self.decisionHits + 1
+            return self._decision[1]
+        self.decisionMisses = self.decisionMisses + 1
+
+        if self._memo is not None:
+            memoKey = self._memoKey(status)
+            entry = self._memo.get(memoKey)
+            if entry is not None and self._memoValid(entry[0]):
+                self._memo.move_to_end(memoKey)
+                self.memoHits = self.memoHits + 1
+                self._decision = (key, entry[1])
+                return entry[1]
+            self.memoMisses = self.memoMisses + 1
+
+        if DEBUG_MODE: debug("getBestAction - actions:", str([x for x in self.availableActionsByMotor()]))
+
+        actions_objective = self.motorQ()
+
+        if DEBUG_MODE: debug("getBestAction - => OBJECTIVE_ACTIONS", actions_objective)
+
+        actions = []
+        for action, v in list(actions_objective.items()):
+            actions.append((self.evaluateActionUtility(v, status), action, v))
+
+        actions = sorted(actions, key=lambda x:-x[0])
+        if DEBUG_MODE: debug("getBestAction - DECIDE", actions)
+        self._decision = (key, actions)
+        if self._memo is not None:
+            self._memo[memoKey] = (self._qClock, actions)
+            self._memo.move_to_end(memoKey)
+            if len(self._memo) > self.config.decision_memo_size:
+                self._memo.popitem(last=False)
+        return actions
+
+    # Rankings are memoized by the top-active nodes and the needs rounded to
+    # decision_memo_grid, so similar needs share a ranking.
+    def _memoKey(self, status):
+        grid = self.config.decision_memo_grid
+        return (self._topActive, tuple([(k, round(v/grid)) for k,v in status.items()]))
+
+    # A memoized ranking is valid if no available action has been updated
+    # since it was made
+    def _memoValid(self, clock):
+        if self._qUpdated.get(None, 0) > clock: return False
+        for i in bits(self._topActive):
+            if self._qUpdated.get(i, 0) > clock: return False
+        return True
+
+    def decisionStats(self):
+        return {'hits': self.decisionHits, 'misses': self.decisionMisses,
+                'memo_hits': self.memoHits, 'memo_misses': self.memoMisses}
+
+    # The reward history of a node or action
+    def createRewardHistory(self):
+        return RewardHistory(self.objectiveOrder, self.config.max_reward_history)
+
+    # Approximate memory use in bytes of the nodes, the actions and the reward
+    # histories, and the average per node and action.
+    def memoryUsage(self):
+        nodes = sum([x.sizeof() for x in self.nodes.values()])
+        actions = sum([x.sizeof() for x in self.actions.values()])
+        history = (sum([x.rewardHistory.sizeof() for x in self.nodes.values()]) +
+                   sum([x.rewardHistory.sizeof() for x in self.actions.values()]))
+        total = nodes + actions + history
+        return {'nodes': nodes, 'actions': actions, 'history': history, 'total': total,
+                'bytes_per_node': node.safeDivide(total, len(self.nodes)),
+                'bytes_per_action': node.safeDivide(actions, len(self.actions))}
+
+    # The bytes reclaimed by deleting a node: the node, its actions and their
+    # reward histories.
+    def nodeMemory(self, n):
+        return (n.sizeof() + n.rewardHistory.sizeof() +
+                sum([x.sizeof() + x.rewardHistory.sizeof() for x in n.actions]))
+
+    # Compile the network into a frozen CompiledNetwork, used to run trained
+    # networks without learning.
+    def compile(self):
+        from .compiled import CompiledNetwork
+        return CompiledNetwork(self)
+
     def d(self):
-        return [n.d() for k,n in sorted(self.nodes.items())]
+        return [n.d() for n in sorted(self.nodes.values(), key=lambda x: x.getName())]
 
     def printNetwork(self):
         debug("NETWORK@", self.time, ":")
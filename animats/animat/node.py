@@ -20,6 +20,8 @@
 #    Jonas Colmsjö, 2017-07-21: Converted to Python 3, added support for
 #    several agents, fixed logging etc.
 
+import sys
+
 
 # Setup logging
 # =============
@@ -45,36 +47,76 @@ def makeName(kind, nodes, sort=True):
     else:
         return "%s(%s)" % (kind, ", ".join([x.getName() for x in nodes]))
 
+# Structural key of a node, the kind and the ids of its inputs
+def makeKey(kind, nodes, sort=True):
+    ids = [x.n_id for x in nodes]
+    return (kind, tuple(sorted(ids) if sort else ids))
+
 def safeDivide(a,b,c=0.0):
     if b != 0: return a/b
     else: return c
 
 class Node:
+    # The kind of node, unnamed nodes are identified by the kind and inputs.
+    # The order of the inputs only matters for ordered kinds.
+    kind = None
+    ordered = False
+
+    __slots__ = ('_name', '_named', 'n_id', 'active', 'previousActive', 'pendingPreviousActive',
+                 'inputs', 'outputs', '_numRealOutputs', 'actions', '_actionsByMotor', '_time',
+                 '_activations', '_activeSince', '_propagated', 'createdAt', 'topActive',
+                 'permanent', 'network', 'virtual', 'rewardHistory', '_ancestors')
+
     def __init__(self, name=None, inputs=None, outputs=None, permanent=False, virtual=False):
         self.name = name
+        self.n_id = None
         self.active = False
         self.previousActive = False
         self.pendingPreviousActive = False
         self.inputs = inputs or []
         self.outputs = outputs or []
+        self._numRealOutputs = len([x for x in self.outputs if not x.isVirtual()])
         self.actions = []
-        self.time = 0
-        self.activations = 0
+        self._actionsByMotor = {}
+        self._time = 0
+        self._activations = 0
+        self._activeSince = 0
+        self._propagated = False
         self.createdAt = 0
         self.topActive = False
         self.permanent=permanent
         self.network = None
         self.virtual = virtual
-        self.rewardHistory = []
+        self.rewardHistory = None
+        self._ancestors = None
         for node in self.inputs:
             node.addOutput(self)
 
     def __str__(self):
         return "Node - name: " + self.name + ", previousActive:" + str(self.previousActive) + ", pendingPreviousActive:" + str(self.pendingPreviousActive) + ", inputs:" + str(self.inputs) + ", outputs:" + str(self.outputs) # + ", actions:" + str([str(x) for x in self.actions]) + "topActive:" + str(self.topActive)
 
+    # The names of deep nodes nest the names of their inputs, so they are only
+    # built when they are needed. Networks identify the nodes by getKey.
+    @property
+    def name(self):
+        if self._name is None and self.kind is not None:
+            self._name = makeName(self.kind, self.inputs, not self.ordered)
+            if self.network: self.network._nameBuilt(self)
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self._named = name is not None
+
     def getName(self):
         return self.name
 
+    def getKey(self):
+        if self._named or self.kind is None or any(x.n_id is None for x in self.inputs):
+            return (None, self.getName())
+        return makeKey(self.kind, self.inputs, not self.ordered)
+
     def getId(self):
         return id(self)
 
@@ -84,37 +126,79 @@ class Node:
     # Return true if 'node' a child of self, or current node.
     # TODO: Rename?
     def isParent(self, node):
+        # Use the ancestor bitsets when both nodes are indexed by the network
+        if self._ancestors is not None and node._ancestors is not None and self.network is node.network:
+            return (self._ancestors >> node.n_id) & 1 == 1
         if self == node: return True
         for x in self.inputs:
             if x.isParent(node): return True
         return False
 
-    # Evaluate/Propagate this node.
+    # A node propagated by a network is evaluated on every tick, the network
+    # just skips the evaluation when none of the inputs changed.
+    @property
+    def time(self):
+        if self._propagated: return self.network.time
+        return self._time
+
+    @time.setter
+    def time(self, time):
+        self._time = time
+
+    # Number of ticks this node has been active, the current run is counted
+    # lazily so that unchanged nodes don't have to be visited every tick.
+    @property
+    def activations(self):
+        if self.active:
+            return self._activations + self.time - self._activeSince + 1
+        return self._activations
+
+    # Return the new activation of this node given the state of the inputs.
+    def evaluate(self):
+        return False
+
+    # Evaluate/Propagate this node, depth first. Used for nodes outside of a
+    # network, Network.tick propagates its nodes incrementally.
     def tick(self, time):
         debug('tick - name:', self.name)
         if self.time >= time:
             return False
-        self.time = time
-        self.pendingPreviousActive = self.active
-        self.active = False
         for node in self.inputs:
             node.tick(time)
+        self._setActive(time, self.evaluate())
         return True
 
+    def _setActive(self, time, active):
+        self.pendingPreviousActive = self.active
+        if active:
+            self.activate(time)
+        else:
+            self.deactivate(time)
+
     def setNetwork(self, network):
         self.network = network
         self.createdAt = network.getTime()
         self.n_id = network.getNodeCount()
+        self.rewardHistory = network.createRewardHistory()
 
         # TODO: Evaluate if we shouldn't add all actions by default?
         for motor in network.motors:
             self.createAction(motor)
 
-        debug('setNetwork - name:', self.name, ", network:", network, "actions:", [str(x.node) for x in self.actions])
+        if DEBUG_MODE: debug('setNetwork - name:', self.name, ", network:", network, "actions:", [str(x.node) for x in self.actions])
 
     def addOutput(self, node):
         if node not in self.outputs:
             self.outputs.append(node)
+            if not node.isVirtual(): self._addRealOutputs(1)
+
+    def removeOutput(self, node):
+        self.outputs.remove(node)
+        if not node.isVirtual(): self._addRealOutputs(-1)
+
+    def _addRealOutputs(self, n):
+        self._numRealOutputs = self._numRealOutputs + n
+        if self.network: self.network._indexNode(self)
 
     # TODO: Should we handle previousActive here, or in tick?
     # Does previousActive mean it was active the previous tick, or should a node
@@ -122,12 +206,15 @@ class Node:
     # For the future...
     def activate(self, time):
         if self.time <= time:
+            if not self.active:
+                self._activeSince = time
             self.active = True
             self.time = time
-            self.activations = self.activations + 1
 
     def deactivate(self, time):
         if self.time <= time:
+            if self.active:
+                self._activations = self._activations + time - self._activeSince
             self.active = False
             self.time = time
 
@@ -137,15 +224,15 @@ class Node:
     def getR(self, motor):
         return self.findAction(motor).getR()
 
+    # motor is either the name of a motor or a Motor
     def findAction(self, motor):
-        for a in self.actions:
-            if a.motor.name == motor: return a
-        return None
+        return self._actionsByMotor.get(getattr(motor, 'name', motor), None)
 
     def createAction(self, motor, reward=None):
         if self.findAction(motor): return self.findAction(motor)
         action = self.network.createAction(self, motor, reward)
         self.actions.append(action)
+        self._actionsByMotor[action.motor.name] = action
         return action
 
     def isActive(self):
@@ -158,7 +245,7 @@ class Node:
         if includeVirtual==False and self.virtual:
             return False
         else:
-            return len([x for x in self.outputs if not x.isVirtual()]) == 0
+            return self._numRealOutputs == 0
 
     def isTopActive(self, includeVirtual=False):
         if includeVirtual==False and self.virtual:
@@ -169,23 +256,9 @@ class Node:
     def realOutputs(self):
         return [x for x in self.outputs if not x.isVirtual()]
 
-    # Utility function used by network to find topActive nodes when propagating.
-    # Traverse tree from bottom to top (sensors => topnodes), depth first
-    def _findTopActive(self, verbose=False):
-        found = False
-        for node in self.realOutputs():
-            found = node._findTopActive(verbose) or found
-        if found:
-            return True
-        elif self.active:
-            self.topActive = True
-        return self.topActive
-
     def updateQ(self, motor, reward, Qst1a):
-        debug("updateQ - name:", self.name, ", motor:", motor, ", reward:", reward, ", Qst1a:", Qst1a)
+        if DEBUG_MODE: debug("updateQ - name:", self.name, ", motor:", motor, ", reward:", reward, ", Qst1a:", Qst1a)
         self.rewardHistory.append(reward)
-        if len(self.rewardHistory) > self.network.config.max_reward_history:
-            del self.rewardHistory[0]
 
         action = self.findAction(motor)
         action.updateQ(reward, Qst1a)
@@ -214,5 +287,24 @@ class Node:
     def getNumTriggers(self):
         return sum([a.triggers for a in self.actions])
 
+    # The largest difference in Q between the actions of this node, over the
+    # objectives. Nodes with a small spread don't tell the motors apart.
+    def getQSpread(self):
+        spread = 0.0
+        for need in self.network.objectives:
+            Q = [a.getQ(need) for a in self.actions]
+            if Q: spread = max(spread, max(Q) - min(Q))
+        return spread
+
+    # Approximate size in bytes of the node and its lists, not counting the
+    # actions and the reward history.
+    def sizeof(self):
+        return (sys.getsizeof(self) + sys.getsizeof(self.inputs) + sys.getsizeof(self.outputs) +
+                sys.getsizeof(self.actions) + sys.getsizeof(self._actionsByMotor))
+
     def makeReal(self):
-        self.virtual = False
+        if self.virtual:
+            self.virtual = False
+            for node in self.inputs:
+                node._addRealOutputs(1)
+        if self.network: self.network._indexNode(self)
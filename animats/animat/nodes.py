@@ -51,56 +51,41 @@ def truth(v):
     return (on, off, total)
 
 class AndNode(Node):
+    kind = "AND"
+    __slots__ = ()
+
     def __init__(self, name=None, inputs=[], outputs=[],permanent=False,virtual=False):
-        inputs = sorted(inputs, key=lambda x: x.name)
-        if not name: name = makeName("AND", inputs)
         Node.__init__(self, name, inputs, outputs, permanent, virtual)
 
-    def tick(self, time):
-        if Node.tick(self, time):
-            v = [node.active for node in self.inputs]
-            on, off, total = truth(v)
-            if total > 0 and total == on:
-                self.activate(time)
-            else:
-                self.deactivate(time)
-            return True
-        else:
-            return False
+    def evaluate(self):
+        v = [node.active for node in self.inputs]
+        on, off, total = truth(v)
+        return total > 0 and total == on
 
 class NAndNode(Node):
+    kind = "NAND"
+    __slots__ = ()
+
     def __init__(self, name=None, inputs=[], outputs=[], permanent=False):
-        inputs = sorted(inputs, key=lambda x: x.name)
-        if not name: name = makeName("NAND", inputs)
         Node.__init__(self, name, inputs, outputs, permanent)
 
-    def tick(self, time):
-        if Node.tick(self, time):
-            v = [node.active for node in self.inputs]
-            on, off, total = truth(v)
-            if total > 0 and total == on:
-                self.deactivate(time)
-            else:
-                self.activate(time)
-            return True
-        else:
-            return False
+    def evaluate(self):
+        v = [node.active for node in self.inputs]
+        on, off, total = truth(v)
+        return not (total > 0 and total == on)
 
 class SEQNode(Node):
+    kind = "SEQ"
+    ordered = True
+    __slots__ = ()
+
     def __init__(self, name=None, inputs=[], outputs=[],permanent=False,virtual=False):
-        if not name: name = makeName("SEQ", inputs, sort=False)
         Node.__init__(self, name, inputs, outputs, permanent, virtual)
 
-    def tick(self, time):
-        if Node.tick(self, time):
-            if len(self.inputs) > 1:
-                if self.inputs[0].wasActive() and self.inputs[1].isActive():
-                    self.activate(time)
-                else:
-                    self.deactivate(time)
-            return True
-        else:
-            return False
+    def evaluate(self):
+        if len(self.inputs) > 1:
+            return self.inputs[0].wasActive() and self.inputs[1].isActive()
+        return False
 
 # TODO: must update tick code...
 #
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+#    pyAnimat - Simulate Animats using Transparent Graphs as a way to AGI
+#    Copyright (C) 2017  Nils Svangård, Claes Strannegård
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import math
+
+import numpy as np
+
+
+# Setup logging
+# =============
+
+DEBUG_MODE = False
+
+def debug(*args):
+    if DEBUG_MODE: print('DEBUG:objectives:', *args)
+
+def error(*args):
+    print('ERROR:objectives:', *args)
+
+def warn(*args):
+    print('WARNING:objectives:', *args)
+
+
+# The code
+# ========
+
+# The objectives of a network in a fixed order, so that needs, rewards and
+# predictions can be kept as vectors. An objective missing from a reward is
+# nan in its vector, it's left out of updates and counts as 0 in distances.
+class Objectives:
+    def __init__(self, names):
+        self.names = list(names)
+        self.index = {k:i for i,k in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    # Names that aren't objectives are ignored
+    def vector(self, d, missing=np.nan):
+        v = np.full(len(self.names), missing, dtype=float)
+        for k,x in d.items():
+            i = self.index.get(k)
+            if i is not None: v[i] = x
+        return v
+
+    # A reward is either a dict or a scalar given to all objectives
+    def reward(self, r):
+        if type(r) == dict:
+            return self.vector(r)
+        return np.full(len(self.names), r, dtype=float)
+
+    def dict(self, v):
+        return {k:x for k,x in zip(self.names, v.tolist()) if not math.isnan(x)}
+
+    def zeros(self):
+        return np.zeros(len(self.names))
+
+
+def filled(v):
+    return np.where(np.isnan(v), 0.0, v)
+
+def length(v):
+    return math.sqrt(np.square(filled(v)).sum())
+
+def dist(a, b):
+    return math.sqrt(np.square(filled(a) - filled(b)).sum())
+
+def relativeSurprise(a, b):
+    l = min(max(length(a), 0.01), max(length(b), 0.01))
+    return dist(a, b)/l
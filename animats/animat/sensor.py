@@ -42,6 +42,8 @@ def warn(*args):
 # ========
 
 class SensorNode(Node):
+    __slots__ = ('sense',)
+
     def __init__(self, name, sense=None):
         Node.__init__(self, name, permanent=True)
         self.sense=sense
@@ -52,16 +54,16 @@ class SensorNode(Node):
     # JC, replaced self.sense with observation and call from Environment.percept (via Network.tick)
     # Not sure how this fits in: if x == 't': x = 1
     def tick(self, time, observation=None):
-        if Node.tick(self, time):
-            if self.sense is not None:
-                debug('Using self.sense')
-                x = self.sense(time)
-            else:
-                debug('Using observation ', observation)
-                x = observation.get(self.name[1:],0)
+        if self.time >= time:
+            return False
+        self._setActive(time, self.evaluate(observation, time))
+        return True
 
-            if x: self.activate(time)
-            else: self.deactivate(time)
-            return True
+    def evaluate(self, observation=None, time=None):
+        if self.sense is not None:
+            debug('Using self.sense')
+            x = self.sense(time)
         else:
-            return False
+            debug('Using observation ', observation)
+            x = observation.get(self.name[1:],0)
+        return bool(x)
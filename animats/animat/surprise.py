@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+#    pyAnimat - Simulate Animats using Transparent Graphs as a way to AGI
+#    Copyright (C) 2017  Nils Svangård, Claes Strannegård
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+
+from .objectives import filled, length
+
+
+# Setup logging
+# =============
+
+DEBUG_MODE = False
+
+def debug(*args):
+    if DEBUG_MODE: print('DEBUG:surprise:', *args)
+
+def error(*args):
+    print('ERROR:surprise:', *args)
+
+def warn(*args):
+    print('WARNING:surprise:', *args)
+
+
+# The code
+# ========
+
+EVICTION_POLICIES = ['lru', 'least_updated', 'deleted']
+
+# The average reward seen for pairs of nodes, keyed by the node ids. The
+# values are kept in a [pair x objective] array, the rows of removed pairs
+# are filled with the last row.
+#
+# With a limit, pairs are evicted to make room for new ones, a batch at a
+# time. The policy evicts the least recently updated pairs (lru), the pairs
+# with the fewest updates (least_updated), or the pairs with a node that
+# has been deleted from the network (deleted, falls back to lru). Pairs
+# updated in the same step are never evicted, so new pairs that still
+# don't fit are not added.
+class SurpriseMatrix:
+    def __init__(self, network, limit=None, eviction='lru', capacity=64):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError("unknown eviction policy %s" % eviction)
+        self.network = network
+        self.objectives = network.objectiveOrder
+        self.limit = limit
+        self.eviction = eviction
+        self.rows = {}
+        self.keys = []
+        self.values = np.zeros((capacity, len(self.objectives)))
+        self.lastUpdate = np.zeros(capacity, dtype=np.int64)
+        self.numUpdates = np.zeros(capacity, dtype=np.int64)
+        self.clock = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, pair):
+        return pair in self.rows
+
+    def get(self, pair, default=None):
+        row = self.rows.get(pair)
+        if row is None: return default
+        return dict(zip(self.objectives, self.values[row].tolist()))
+
+    def items(self):
+        for pair, v in zip(self.keys, self.values[:len(self.keys)].tolist()):
+            yield pair, dict(zip(self.objectives, v))
+
+    # Move the average of all pairs towards the reward vector, new pairs start
+    # at reward
+    def update(self, pairs, reward, sigma):
+        if not pairs: return
+        self.clock = self.clock + 1
+        if self.limit is not None:
+            self._makeRoom(pairs)
+        r = filled(reward)
+        rows = []
+        for pair in pairs:
+            row = self.rows.get(pair)
+            if row is None:
+                if self.limit is not None and len(self.keys) >= self.limit: continue
+                row = self._add(pair)
+                self.values[row] = r
+            rows.append(row)
+        rows = np.array(rows, dtype=np.int64)
+        self.values[rows] = (1-sigma)*self.values[rows] + sigma*r
+        self.lastUpdate[rows] = self.clock
+        self.numUpdates[rows] = self.numUpdates[rows] + 1
+
+    def _makeRoom(self, pairs):
+        new = len(set([pair for pair in pairs if pair not in self.rows]))
+        if len(self.keys) + new <= self.limit: return
+        for pair in pairs:
+            if pair in self.rows: self.lastUpdate[self.rows[pair]] = self.clock
+
+        evict = []
+        if self.eviction == 'deleted':
+            evict = [pair for pair in self.keys if pair[0] not in self.network.nodes or pair[1] not in self.network.nodes]
+        n = len(self.keys) + new - self.limit
+        if len(evict) < n:
+            # Evict an eighth of the pairs at once, so that it's not done every step
+            n = min(max(n, self.limit//8), len(self.keys))
+            if self.eviction == 'least_updated':
+                order = np.lexsort((self.lastUpdate[:len(self.keys)], self.numUpdates[:len(self.keys)]))
+            else:
+                order = np.argsort(self.lastUpdate[:len(self.keys)], kind='stable')
+            evicted = set(evict)
+            for row in order:
+                if len(evict) >= n: break
+                if self.lastUpdate[row] != self.clock and self.keys[row] not in evicted:
+                    evict.append(self.keys[row])
+        for pair in evict:
+            self.remove(pair)
+        self.evictions = self.evictions + len(evict)
+
+    def _add(self, pair):
+        row = len(self.keys)
+        if row == len(self.values):
+            self.values = _grow(self.values, 2*row or 1)
+            self.lastUpdate = _grow(self.lastUpdate, 2*row or 1)
+            self.numUpdates = _grow(self.numUpdates, 2*row or 1)
+        self.rows[pair] = row
+        self.keys.append(pair)
+        self.numUpdates[row] = 0
+        return row
+
+    def remove(self, pair):
+        row = self.rows.pop(pair)
+        last = len(self.keys) - 1
+        if row != last:
+            self.keys[row] = self.keys[last]
+            self.rows[self.keys[row]] = row
+            for column in [self.values, self.lastUpdate, self.numUpdates]:
+                column[row] = column[last]
+        self.keys.pop()
+
+    # Remove all pairs with one of the node ids, returns the number of pairs
+    def removeNodes(self, ids):
+        pairs = [pair for pair in self.keys if pair[0] in ids or pair[1] in ids]
+        for pair in pairs:
+            self.remove(pair)
+        return len(pairs)
+
+    def occupancy(self):
+        if not self.limit: return 0.0
+        return len(self.keys) / self.limit
+
+    def stats(self):
+        return {'pairs': len(self.keys), 'limit': self.limit, 'occupancy': self.occupancy(), 'evictions': self.evictions}
+
+    # relativeSurprise of every pair given the reward vector, in the order of keys
+    def surprises(self, reward):
+        values = self.values[:len(self.keys)]
+        dist = np.sqrt(np.square(values - filled(reward)).sum(axis=1))
+        lengths = np.maximum(np.sqrt(np.square(values).sum(axis=1)), 0.01)
+        return dist / np.minimum(lengths, max(length(reward), 0.01))
+
+    # The least surprised pair given reward as (surprise, pair), ties are
+    # broken by key(pair). None if there are no pairs.
+    def leastSurprised(self, reward, key=None):
+        if not self.keys: return None
+        surprises = self.surprises(reward)
+        best = surprises.min()
+        pairs = [self.keys[i] for i in np.nonzero(surprises == best)[0]]
+        return (float(best), min(pairs, key=key))
+
+    # The pairs by node name
+    def d(self):
+        names = lambda i: self.network.nodes[i].getName() if i in self.network.nodes else i
+        return {(names(a), names(b)):v for (a,b),v in self.items()}
+
+
+def _grow(a, capacity):
+    res = np.zeros((capacity,) + a.shape[1:], dtype=a.dtype)
+    res[:len(a)] = a
+    return res
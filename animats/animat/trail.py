@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+#    pyAnimat - Simulate Animats using Transparent Graphs as a way to AGI
+#    Copyright (C) 2017  Nils Svangård, Claes Strannegård
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+
+import numpy as np
+
+
+# Setup logging
+# =============
+
+DEBUG_MODE = False
+
+def debug(*args):
+    if DEBUG_MODE: print('DEBUG:trail:', *args)
+
+def error(*args):
+    print('ERROR:trail:', *args)
+
+def warn(*args):
+    print('WARNING:trail:', *args)
+
+
+# The code
+# ========
+
+# One step of a trail, the active sensors and the action are codes in the
+# cells and actions tables.
+STEP = np.dtype([('cell', '<i4'), ('action', '<i4'), ('wellbeeing', '<f8')])
+
+# The trail of an agent, the active sensors, action and wellbeeing of every
+# step. Steps are recorded in chunks of typed arrays. After open, full
+# chunks are appended to a file instead of kept in memory, the code tables
+# are written next to it as json so that a trail can be read while it's
+# still being recorded. The file is only open while a chunk is written, so
+# that many agents can record at once.
+#
+# Iterating a trail gives (cell, action) like the old list of steps.
+class Trail:
+    def __init__(self, chunkSize=4096):
+        self.chunkSize = chunkSize
+        self.chunks = []
+        self.buffer = np.zeros(chunkSize, dtype=STEP)
+        self.size = 0
+        self.spilled = 0
+        self.cells = []
+        self.actions = []
+        self._codes = ({}, {})
+        self._tablesChanged = False
+        self.path = None
+        self.recording = False
+
+    def __len__(self):
+        return self.spilled + sum([len(x) for x in self.chunks]) + self.size
+
+    def __iter__(self):
+        for chunk in self._chunks():
+            for cell, action in zip(chunk['cell'].tolist(), chunk['action'].tolist()):
+                yield (list(self.cells[cell]), self.actions[action])
+
+    # Append the rest of the trail to path
+    def open(self, path):
+        self.close()
+        self.path = path
+        self.recording = True
+        with open(path, 'wb') as fp:
+            for chunk in self.chunks:
+                chunk.tofile(fp)
+                self.spilled = self.spilled + len(chunk)
+        self.chunks = []
+        self._tablesChanged = True
+        self.flush()
+
+    def close(self):
+        if not self.recording: return
+        if self.size > 0: self._spill()
+        self.flush()
+        self.recording = False
+
+    def append(self, cell, action, wellbeeing):
+        step = self.buffer[self.size]
+        step['cell'] = self._code(0, self.cells, tuple(cell))
+        step['action'] = self._code(1, self.actions, action)
+        step['wellbeeing'] = wellbeeing
+        self.size = self.size + 1
+        if self.size == self.chunkSize:
+            self._spill()
+
+    def _code(self, i, table, value):
+        code = self._codes[i].get(value)
+        if code is None:
+            code = len(table)
+            table.append(value)
+            self._codes[i][value] = code
+            self._tablesChanged = True
+        return code
+
+    def _spill(self):
+        chunk = self.buffer[:self.size]
+        if not self.recording:
+            self.chunks.append(chunk.copy())
+        else:
+            with open(self.path, 'ab') as fp:
+                chunk.tofile(fp)
+            self.spilled = self.spilled + self.size
+        self.size = 0
+        self.flush()
+
+    # Write the code tables of the spilled steps
+    def flush(self):
+        if not self.recording: return
+        if self._tablesChanged:
+            with open(self.path + '.json', 'w') as fp:
+                json.dump({'cells': self.cells, 'actions': self.actions}, fp)
+            self._tablesChanged = False
+
+    def _chunks(self):
+        if self.spilled > 0:
+            steps = np.memmap(self.path, dtype=STEP, mode='r', shape=(self.spilled,))
+            for i in range(0, self.spilled, self.chunkSize):
+                yield steps[i:i+self.chunkSize]
+        for chunk in self.chunks:
+            yield chunk
+        yield self.buffer[:self.size]
+
+    # The wellbeeing of every step as an array
+    def wellbeeings(self):
+        return np.concatenate([chunk['wellbeeing'] for chunk in self._chunks()])
+
+    # The wellbeeing of every step, one chunk at a time
+    def iterWellbeeings(self):
+        for chunk in self._chunks():
+            yield from chunk['wellbeeing'].tolist()
+
+
+# Read a trail written by Trail.open, returns the steps as an array and the
+# cells and actions tables.
+def readTrail(path):
+    with open(path + '.json') as fp:
+        tables = json.load(fp)
+    return np.fromfile(path, dtype=STEP), tables['cells'], tables['actions']
@@ -57,10 +57,16 @@ def getOutputPath():
         if exception.errno != errno.EEXIST:
             raise
 
-def run(inputPath, outputPath, outputDir=None, wss=None):
-    wellbeeings1 = []
-    wellbeeings2 = []
+# The name of the i:th agent, A to Z and then A26, A27 and so on
+def agentName(i):
+    return chr(ord('A') + i) if i < 26 else 'A%d' % i
+
+# Wellbeeings are written with decimal comma, whole numbers without decimals
+def formatWellbeeing(w):
+    if float(w).is_integer(): return str(int(w))
+    return str(w).replace(".",",")
 
+def run(inputPath, outputPath, outputDir=None, wss=None):
     with open(inputPath, encoding='utf-8') as data_file:
         conf = json.loads(data_file.read())
 
@@ -69,58 +75,49 @@ def run(inputPath, outputPath, outputDir=None, wss=None):
 
     agentConfig = AgentConfig(conf.get("agent"))
 
-    agnt1 = createAgent(agentConfig, {k:1 for k in conf.get("objectives")})
-    agnt1.name = 'A'
-
-    agnt2 = createAgent(agentConfig, {k:1 for k in conf.get("objectives")})
-    agnt2.name = 'B'
+    agnts = []
+    for i in range(conf.get("agents", 2)):
+        agnt = createAgent(agentConfig, {k:1 for k in conf.get("objectives")})
+        agnt.name = agentName(i)
+        agnts.append(agnt)
 
     fieldConfig = {
         'numTilesPerSquare': (1, 1),
         'drawGrid': True,
         'randomTerrain': 0,
         'terrain': envConfig.worldmap,
-        'agents': {
-            'A': {
-                'name': 'A',
-                'pos': (0, 0),
-                'hidden': False
-            },
-            'B': {
-                'name': 'B',
-                'pos': (0, 0),
-                'hidden': False
-            }
-        }
+        'agents': {agnt.name: {'name': agnt.name, 'pos': (0, 0), 'hidden': False} for agnt in agnts}
     }
 
     env = Environment(envConfig, None, wss, fieldConfig)
-    env.add_thing(agnt1, 1)
-    env.add_thing(agnt2, 2)
+    for i, agnt in enumerate(agnts):
+        env.add_thing(agnt, i + 1)
+
+    # Stream the trails to the output directory during the run
+    if outputDir is not None:
+        for agnt in agnts:
+            agnt.trail.open(os.path.join(outputDir, "trail-%s.bin" % agnt.name))
 
     if wss is not None:
         wss.send_init(fieldConfig)
 
     env.run(envConfig.maxIterations)
+    for agnt in agnts:
+        agnt.trail.close()
 
     if DEBUG_MODE:
-        agnt1.network.printNetwork()
+        agnts[0].network.printNetwork()
         env.printWorld()
-        for i,x in enumerate(agnt1.trail):
+        for i,x in enumerate(agnts[0].trail):
             print((i, x[0], x[1]))
         print("SURPRISE MATRIX")
-        pprint(agnt1.surpriseMatrix)
+        pprint(agnts[0].surpriseMatrix.d())
         print("SEQ SURPRISE MATRIX")
-        pprint(agnt1.surpriseMatrix_SEQ)
-
-    wellbeeings1.append(agnt1.wellbeeingTrail)
-    wellbeeings2.append(agnt2.wellbeeingTrail)
-
-    # Save the wellbeeing trails to file
-    fp = open(outputPath+'.1', "w")
-    print("\n".join([";".join([str(x).replace(".",",") for x in line]) for line in zip(*wellbeeings1)]), file=fp)
-    fp.close()
-
-    fp = open(outputPath+'.2', "w")
-    print("\n".join([";".join([str(x).replace(".",",") for x in line]) for line in zip(*wellbeeings1)]), file=fp)
-    fp.close()
+        pprint(agnts[0].surpriseMatrix_SEQ.d())
+
+    # Save the wellbeeing trails to file, one per agent
+    for i, agnt in enumerate(agnts):
+        fp = open(outputPath+'.%d' % (i + 1), "w")
+        for w in agnt.trail.iterWellbeeings():
+            print(formatWellbeeing(w), file=fp)
+        fp.close()
@@ -9,12 +9,21 @@
 # ======
 
 import os
+import resource
+import json
+import random
 import filecmp
 import difflib
 import datetime
+import tempfile
 import unittest
+
+import numpy as np
+
 import animats.main
 
+from animats.animat import agent, environment, fieldofview, network, node, nodes, objectives, surprise, trail
+
 
 # Setup logging
 # =============
@@ -75,6 +84,596 @@ class TestAnimats(unittest.TestCase):
         log('...done with test.')
 
 
+def createNetwork(sensors=('a', 'b'), motors=('eat', 'left'), **kwargs):
+    conf = dict(kwargs, sensors=list(sensors), motors=list(motors))
+    return agent.createNetwork(network.NetworkConfig(conf), {'energy': 1.0, 'water': 1.0}, 0)
+
+
+class TestNetwork(unittest.TestCase):
+
+    def test_incremental_propagation(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        both = nodes.AndNode(inputs=[a, b])
+        seq = nodes.SEQNode(inputs=[a, b])
+        net.addNodes([both, seq])
+
+        net.tick({'a': 1})
+        self.assertEqual([a.active, b.active, both.active, seq.active], [True, False, False, False])
+        net.tick({'b': 1})
+        self.assertEqual([a.active, b.active, both.active, seq.active], [False, True, False, True])
+        net.tick({'a': 1, 'b': 1})
+        self.assertEqual([both.active, seq.active], [True, False])
+        self.assertEqual(net.activeTopNodes(), [both])
+
+        # Unchanged sensors, nothing is evaluated but the counters still run
+        net.tick({'a': 1, 'b': 1})
+        net.tick({'a': 1, 'b': 1})
+        self.assertEqual([a.activations, b.activations, both.activations, seq.activations], [4, 4, 3, 1])
+        self.assertEqual(both.getAge(), 5)
+
+    def test_rejected_duplicate_node(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        both = nodes.AndNode(inputs=[a, b])
+        self.assertTrue(net.addNode(both))
+        self.assertFalse(net.addNode(nodes.AndNode(inputs=[a, b])))
+        self.assertEqual([a.outputs, b.outputs], [[both], [both]])
+        net.tick({'a': 1, 'b': 1})
+        net.tick({'b': 1})
+        self.assertEqual([x.getName() for x in net.activeTopNodes()], ['$b'])
+        self.assertTrue(net.deleteNode(both))
+        self.assertTrue(a.isTopNode())
+
+        # Nodes that were never added aren't evaluated
+        nodes.AndNode(inputs=[a, b])
+        net.tick({'a': 1, 'b': 1})
+        self.assertEqual([x.getName() for x in net.activeTopNodes()], ['$a', '$b'])
+
+    def test_node_indexes(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        self.assertEqual(net.topNodes(), [a, b])
+        both = nodes.AndNode(inputs=[a, b], virtual=True)
+        net.addNode(both)
+        self.assertEqual(net.topNodes(), [a, b])
+        self.assertEqual(net.topNodes(includeVirtual=True), [a, b, both])
+        self.assertEqual(net.virtualNodes(), [both])
+
+        net.tick({'a': 1, 'b': 1})
+        self.assertEqual(net.activeVirtualNodes(), [both])
+        self.assertEqual(net.activeTopNodes(), [a, b])
+
+        both.makeReal()
+        self.assertEqual(net.topNodes(), [both])
+        self.assertEqual(net.virtualNodes(), [])
+        net.tick({'a': 1, 'b': 1})
+        self.assertEqual(net.activeTopNodes(), [both])
+
+        self.assertTrue(net.deleteNode(both))
+        self.assertEqual(net.topNodes(), [a, b])
+        net.tick({'a': 1})
+        self.assertEqual(net.activeTopNodes(), [a])
+
+
+    def test_decision_cache(self):
+        net = createNetwork(epsilon=0.0)
+        a = net.findNode('$a')
+        net.tick({'a': 1})
+        needs = {'energy': 0.5, 'water': 0.5}
+        first = net.getBestAction(needs)
+        self.assertIs(net.getBestAction(needs)[2], first[2])
+        self.assertEqual(net.decisionStats(), {'hits': 1, 'misses': 1, 'memo_hits': 0, 'memo_misses': 0})
+        a.updateQ('left', {'energy': 0.5, 'water': 0.5}, {})
+        self.assertEqual(net.getBestAction(needs)[1], 'left')
+        net.getBestAction({'energy': 0.4, 'water': 0.5})
+        net.tick({'a': 1})
+        net.getBestAction({'energy': 0.4, 'water': 0.5})
+        self.assertEqual(net.decisionStats(), {'hits': 1, 'misses': 4, 'memo_hits': 0, 'memo_misses': 0})
+
+    def test_decision_memo(self):
+        net = createNetwork(epsilon=0.0, decision_memo_size=2, decision_memo_grid=0.1)
+        a, b = net.findNode('$a'), net.findNode('$b')
+        a.updateQ('eat', {'energy': 0.5, 'water': 0.5}, {})
+        net.tick({'a': 1})
+        ranking = net._rankActions({'energy': 0.5, 'water': 0.5})
+        net.tick({'b': 1})
+        net.getBestAction({'energy': 0.5, 'water': 0.5})
+        net.tick({'a': 1})
+        self.assertIs(net._rankActions({'energy': 0.52, 'water': 0.5}), ranking)
+        self.assertEqual(net.decisionStats()['memo_hits'], 1)
+
+        # Updates of other nodes don't invalidate the ranking
+        b.updateQ('left', {'energy': 0.5, 'water': 0.5}, {})
+        self.assertIs(net._rankActions({'energy': 0.48, 'water': 0.5}), ranking)
+        a.updateQ('left', {'energy': 0.5, 'water': 0.5}, {})
+        self.assertIsNot(net._rankActions({'energy': 0.5, 'water': 0.5}), ranking)
+        self.assertEqual(net.decisionStats()['memo_misses'], 3)
+
+        both = nodes.AndNode(inputs=[a, b])
+        net.addNode(both)
+        both.updateQ('eat', {'energy': 0.5, 'water': 0.5}, {})
+        self.assertIn(both.n_id, net._qUpdated)
+        net.deleteNode(both)
+        self.assertNotIn(both.n_id, net._qUpdated)
+
+    def test_columnar_action_store(self):
+        results = []
+        for store in ['dict', 'columnar']:
+            net = createNetwork(action_store=store, epsilon=0)
+            a, b = net.findNode('$a'), net.findNode('$b')
+            net.tick({'a': 1, 'b': 1})
+            a.updateQ('eat', {'energy': 0.3, 'water': -0.1}, {'energy': 0.1})
+            a.updateQ('eat', {'energy': -0.2}, {})
+            b.updateQ('eat', {'energy': 0.1, 'water': 0.1}, {'water': 0.5})
+            b.updateQ('left', {'energy': -0.01, 'water': -0.01}, {})
+            action = b.findAction('eat')
+            results.append((net.getBestAction({'energy': 0.5, 'water': 0.9}), net.predictR('eat'),
+                            action.getQ(), action.getMinQ('energy'), action.getMaxQ('water'), action.triggers))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][0][1], 'eat')
+
+    def test_action_store_reuses_rows(self):
+        net = createNetwork(action_store='columnar')
+        a, b = net.findNode('$a'), net.findNode('$b')
+        for _ in range(50):
+            both = nodes.AndNode(inputs=[a, b])
+            net.addNode(both)
+            self.assertEqual(both.findAction('eat').triggers, 0)
+            both.updateQ('eat', {'energy': 0.5, 'water': 0.1}, {})
+            self.assertTrue(net.deleteNode(both))
+        store = net._store
+        self.assertEqual(len(store), len(net.actions))
+        self.assertEqual(store.size, len(net.actions) + len(net.motors))
+
+    def test_motor_q_cache(self):
+        net = createNetwork()
+        a = net.findNode('$a')
+        net.tick({'a': 1})
+        before = net.motorQ()
+        self.assertIs(net.motorQ()['eat'], before['eat'])
+        a.updateQ('eat', {'energy': 0.5, 'water': 0.0}, {})
+        after = net.motorQ()
+        self.assertIs(after['left'], before['left'])
+        self.assertEqual(after['eat']['energy']['max'], 0.05)
+
+    def test_deep_network(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        top = a
+        debugMode, node.DEBUG_MODE = node.DEBUG_MODE, False
+        for i in range(3000):
+            top = nodes.AndNode(name='n%d' % i, inputs=[top, b])
+            net.addNode(top)
+        node.DEBUG_MODE = debugMode
+        net.tick({'a': 1, 'b': 1})
+        self.assertEqual(net.activeTopNodes(), [top])
+        net.tick({'b': 1})
+        self.assertEqual(net.activeTopNodes(), [b])
+        self.assertTrue(top.isParent(a))
+        self.assertTrue(top.isParent(top))
+        self.assertFalse(a.isParent(top))
+        self.assertFalse(a.isParent(b))
+
+    def test_node_registry(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        both = nodes.AndNode(inputs=[b, a])
+        seq = nodes.SEQNode(inputs=[b, a])
+        debugMode, node.DEBUG_MODE = node.DEBUG_MODE, False
+        net.addNodes([both, seq])
+        node.DEBUG_MODE = debugMode
+        self.assertIsNone(both._name)
+        self.assertTrue(net.hasAndNode([a, b]))
+        self.assertTrue(net.hasSeqNode([b, a]))
+        self.assertFalse(net.hasSeqNode([a, b]))
+        self.assertIs(net.findNode('SEQ($b, $a)'), seq)
+        self.assertEqual(both.getName(), 'AND($a, $b)')
+        self.assertIs(net.findNodeByKey(both.getKey()), both)
+
+    def test_activation_masks(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        both = nodes.AndNode(inputs=[a, b])
+        seq = nodes.SEQNode(inputs=[b, a])
+        net.addNodes([both, seq])
+        for observation in [{'a': 1}, {'b': 1}, {'a': 1}, {'a': 1}, {'a': 1, 'b': 1}]:
+            net.tick(observation)
+            for x in net.allNodes():
+                self.assertEqual(net._active >> x.n_id & 1, x.active)
+                self.assertEqual(net._previous >> x.n_id & 1, x.previousActive)
+                self.assertEqual(net._pending >> x.n_id & 1, x.pendingPreviousActive)
+        self.assertEqual(net.activeSensorMask(), 1 << a.n_id | 1 << b.n_id)
+        self.assertEqual(net.activeTopNodes(), [both])
+
+        net.deleteNode(both)
+        net.tick({'a': 1, 'b': 1})
+        self.assertEqual(net.activeTopNodes(), [a, b])
+
+    def test_pruning(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        both = nodes.AndNode(inputs=[a, b])
+        seq = nodes.SEQNode(inputs=[a, b])
+        net.addNodes([both, seq])
+        both.updateQ('eat', {'energy': 0.5, 'water': 0.0}, {})
+        for i in range(5):
+            net.tick({'a': 1, 'b': 1})
+
+        conf = agent.AgentConfig({'pruning': {'min_age': 5, 'min_triggers': 1, 'min_activations': 10}})
+        animat = agent.Agent(conf, net)
+        animat.surpriseMatrix_SEQ.update([(seq.n_id, a.n_id)], net.objectiveSpace.zeros(), 0.1)
+        animat.surpriseMatrix.update([(a.n_id, b.n_id)], net.objectiveSpace.zeros(), 0.5)
+        report = animat._prune()
+        self.assertEqual([report['nodes'], report['actions'], report['surprise_pairs']], [1, 2, 1])
+        self.assertGreater(report['bytes'], 0)
+        self.assertEqual(net.allNodes(), [a, b, both])
+        self.assertEqual(len(net.actions), 6)
+
+        conf.pruning.max_nodes = 2
+        self.assertEqual(animat._prune()['nodes'], 1)
+        self.assertEqual(net.allNodes(), [a, b])
+
+    def test_pruning_max_bytes(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        both = nodes.AndNode(inputs=[a, b])
+        net.addNode(both)
+        both.updateQ('eat', {'energy': 0.5, 'water': 0.0}, {})
+        conf = agent.AgentConfig({'pruning': {'min_age': 5, 'min_triggers': 1, 'min_activations': 10}})
+        animat = agent.Agent(conf, net)
+        before = net.memoryUsage()['total']
+        conf.pruning.max_bytes = before - 1
+        report = animat._prune()
+        self.assertEqual(report['nodes'], 1)
+        self.assertGreater(report['bytes'], 0)
+        self.assertLessEqual(net.memoryUsage()['total'], conf.pruning.max_bytes)
+        self.assertEqual(net.allNodes(), [a, b])
+
+    def test_memory_usage(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        self.assertFalse(hasattr(a, '__dict__'))
+        before = net.memoryUsage()
+        both = nodes.AndNode(inputs=[a, b])
+        net.addNode(both)
+        both.updateQ('eat', {'energy': 0.5, 'water': 0.0}, {})
+        after = net.memoryUsage()
+        self.assertGreater(after['nodes'], before['nodes'])
+        self.assertGreater(after['actions'], before['actions'])
+        self.assertGreater(after['history'], before['history'])
+        self.assertEqual(after['total'], after['nodes'] + after['actions'] + after['history'])
+        self.assertEqual(after['bytes_per_node'], after['total'] / 3)
+
+    def test_reward_history(self):
+        net = createNetwork(max_reward_history=3)
+        a = net.findNode('$a')
+        for r in [0.1, 0.2, 0.3, 0.4]:
+            a.updateQ('eat', {'energy': r, 'water': -r}, {})
+        history = a.findAction('eat').rewardHistory
+        self.assertEqual(len(history), 3)
+        self.assertEqual([x['energy'] for x in history], [0.2, 0.3, 0.4])
+        self.assertAlmostEqual(history.mean('energy'), 0.3)
+        self.assertAlmostEqual(history.var('water'), 0.02/3)
+        self.assertEqual(history.min(), {'energy': 0.2, 'water': -0.4})
+        self.assertEqual(history.max('water'), -0.2)
+        self.assertEqual(len(a.rewardHistory), 3)
+        self.assertEqual(len(a.findAction('left').rewardHistory), 0)
+        self.assertEqual(a.findAction('left').rewardHistory.mean(), {'energy': 0.0, 'water': 0.0})
+        self.assertIsNone(a.findAction('left').rewardHistory.values)
+        self.assertEqual(history.values.shape, (history.capacity, 2))
+
+    def test_surprise_matrix(self):
+        net = createNetwork()
+        matrix = surprise.SurpriseMatrix(net)
+        matrix.update([(0, 1), (1, 0)], net.objectiveSpace.vector({'energy': 1.0}), 0.5)
+        matrix.update([(0, 1), (2, 3)], net.objectiveSpace.vector({'energy': 0.0, 'water': 1.0}), 0.5)
+        self.assertEqual(matrix.get((0, 1)), {'energy': 0.5, 'water': 0.5})
+        self.assertEqual(matrix.get((1, 0)), {'energy': 1.0, 'water': 0.0})
+        self.assertEqual(matrix.get((2, 3)), {'energy': 0.0, 'water': 1.0})
+        self.assertEqual(matrix.removeNodes({0}), 2)
+        self.assertEqual(list(matrix.items()), [((2, 3), {'energy': 0.0, 'water': 1.0})])
+        self.assertNotIn((0, 1), matrix)
+
+    def test_surprise_eviction(self):
+        net = createNetwork()
+        a, b = net.findNode('$a'), net.findNode('$b')
+        reward = net.objectiveSpace.vector({'energy': 1.0, 'water': 0.0})
+        lru = surprise.SurpriseMatrix(net, limit=2)
+        lru.update([(0, 1), (1, 0)], reward, 0.5)
+        lru.update([(0, 1)], reward, 0.5)
+        lru.update([(0, 1), (2, 3)], reward, 0.5)
+        self.assertEqual(sorted(lru.keys), [(0, 1), (2, 3)])
+        self.assertEqual(lru.stats(), {'pairs': 2, 'limit': 2, 'occupancy': 1.0, 'evictions': 1})
+
+        # Pairs updated in the same step are kept, new pairs that don't fit are skipped
+        lru.update([(0, 1), (2, 3), (1, 2), (1, 2)], reward, 0.5)
+        self.assertEqual(sorted(lru.keys), [(0, 1), (2, 3)])
+        lru.update([(3, 4), (4, 5), (5, 6)], reward, 0.5)
+        self.assertLessEqual(len(lru), lru.limit)
+
+        least = surprise.SurpriseMatrix(net, limit=2, eviction='least_updated')
+        least.update([(0, 1), (1, 0)], reward, 0.5)
+        least.update([(1, 0)], reward, 0.5)
+        least.update([(1, 0)], reward, 0.5)
+        least.update([(0, 1)], reward, 0.5)
+        least.update([(2, 3)], reward, 0.5)
+        self.assertEqual(sorted(least.keys), [(1, 0), (2, 3)])
+
+        both = nodes.AndNode(inputs=[a, b])
+        net.addNode(both)
+        deleted = surprise.SurpriseMatrix(net, limit=2, eviction='deleted')
+        deleted.update([(both.n_id, a.n_id)], reward, 0.5)
+        deleted.update([(a.n_id, b.n_id)], reward, 0.5)
+        net.deleteNode(both)
+        deleted.update([(b.n_id, a.n_id)], reward, 0.5)
+        self.assertEqual(sorted(deleted.keys), [(a.n_id, b.n_id), (b.n_id, a.n_id)])
+        self.assertRaises(ValueError, surprise.SurpriseMatrix, net, 2, 'fifo')
+
+    def test_least_surprised(self):
+        net = createNetwork()
+        space = net.objectiveSpace
+        matrix = surprise.SurpriseMatrix(net)
+        matrix.update([(0, 1), (1, 0), (2, 3)], space.vector({'energy': 1.0, 'water': 0.2}), 0.5)
+        matrix.update([(2, 3), (1, 2)], space.vector({'energy': -0.5, 'water': 0.0}), 0.5)
+        reward = space.vector({'energy': 0.9, 'water': 0.1})
+        expected = sorted([(objectives.relativeSurprise(space.vector(v), reward), k) for k,v in matrix.items()])
+        self.assertEqual(list(matrix.surprises(reward)), [objectives.relativeSurprise(space.vector(v), reward) for _,v in matrix.items()])
+        self.assertEqual(matrix.leastSurprised(reward), expected[0])
+        self.assertEqual(matrix.leastSurprised(reward, key=lambda x: -x[0]), (expected[0][0], (1, 0)))
+        self.assertIsNone(surprise.SurpriseMatrix(createNetwork()).leastSurprised(reward))
+
+    def test_objective_vectors(self):
+        net = createNetwork()
+        space = net.objectiveSpace
+        reward = space.reward({'water': 0.5, 'fear': 1.0})
+        self.assertEqual(space.dict(reward), {'water': 0.5})
+        self.assertEqual(space.dict(space.reward(-0.1)), {'energy': -0.1, 'water': -0.1})
+        self.assertEqual(objectives.relativeSurprise(space.vector({'energy': 0.0, 'water': 0.5}), reward), 0.0)
+        self.assertEqual(objectives.relativeSurprise(space.vector({'energy': 0.5, 'water': 0.5}), reward), 1.0)
+
+        animat = agent.Agent(agent.AgentConfig({}), net, {'energy': 0.9, 'water': 0.2})
+        animat._updateNeeds(reward)
+        self.assertEqual(animat.needs, {'energy': 0.9, 'water': 0.7})
+        animat._updateNeeds(0.5)
+        self.assertEqual(animat.needs, {'energy': 1.0, 'water': 1.0})
+        animat._updateNeeds(space.vector({'energy': -2.0}))
+        self.assertEqual(animat.needs, {'energy': 0.0, 'water': 1.0})
+        self.assertEqual(animat.wellbeeing(), 0.0)
+
+    def test_grid_world(self):
+        conf = environment.EnvironmentConfig({'world': 'ab \nbca', 'blocks': {'a': {'a': 1}, 'b': {'a': 1, 'b': 1}},
+                                              'transform': {'eat': {'a': 'x'}}})
+        self.assertEqual(conf.blockNames[:5], ['a', 'b', ' ', 'c', 'x'])
+        self.assertEqual(conf.world.dtype, np.uint8)
+        self.assertEqual(conf.world.tolist(), [[0, 1, 2], [1, 3, 0]])
+        self.assertRaises(ValueError, environment.EnvironmentConfig, {'world': 'ab\na'})
+
+        env = environment.Environment(conf)
+        net = createNetwork()
+        animat = agent.Agent(agent.AgentConfig({}), net, position=(3, 1))
+        env.percept(animat)
+        self.assertEqual(net.activeSensors(), [net.findNode('$a'), net.findNode('$b')])
+        self.assertEqual(env.currentCell(animat, (1, 0)), 'c')
+        env.percept(animat, (1, 0))
+        self.assertEqual(net.activeSensors(), [])
+        env.setCurrentCell(animat, 'y')
+        self.assertEqual(env.currentCell(animat), 'y')
+        env.percept(animat)
+        self.assertEqual(net.activeSensors(), [])
+        self.assertEqual(env.dirtyCells, {(0, 1)})
+
+        animat.position = (1, 1)
+        env.takeAction(animat, 'left')
+        self.assertEqual(env.dirtyCells, {(0, 1)})
+        animat.position = (2, 1)
+        env.takeAction(animat, 'eat')
+        self.assertEqual(env.currentCell(animat), 'x')
+        self.assertEqual(env.dirtyCells, {(0, 1), (2, 1)})
+        self.assertEqual(conf.transforms[conf.motorCode('eat')].tolist(), [4, -1, -1, -1, -1, -1])
+
+    def test_reward_tensor(self):
+        conf = environment.EnvironmentConfig({'world': 'ab', 'objectives': ['energy', 'water'],
+                                              'rewards': {'eat': {'a': {'energy': 0.5}, '*': -0.1}, '*': {'*': -0.01}},
+                                              'agent': {'network': {'motors': ['eat', 'left']}}})
+        self.assertEqual(conf.motorNames, ['eat', 'left'])
+        self.assertEqual(conf.rewards.shape, (2, 2, 2))
+        self.assertTrue(np.isnan(conf.rewards[0, 0, 1]))
+        self.assertEqual(conf.rewards[0, 0, 0], 0.5)
+        self.assertEqual(conf.rewards[0, 1].tolist(), [-0.1, -0.1])
+        self.assertEqual(conf.rewards[1].tolist(), [[-0.01, -0.01], [-0.01, -0.01]])
+        self.assertEqual(conf.reward(conf.motorCode('up'), conf.blockCode('c')).tolist(), [-0.01, -0.01])
+        self.assertEqual(conf.rewards.shape, (3, 3, 2))
+
+        env = environment.Environment(conf)
+        net = createNetwork()
+        animat = agent.Agent(agent.AgentConfig({}), net, position=(0, 0))
+        self.assertEqual(net.objectiveSpace.dict(env.takeAction(animat, 'eat')), {'energy': 0.5})
+
+        # Agents with other objectives than the environment, scalar rewards
+        # are given to all of their objectives
+        conf = environment.EnvironmentConfig({'world': 'ab', 'rewards': {'eat': {'a': {'energy': 0.5}, '*': -0.1}}})
+        self.assertEqual(conf.objectives, ['water', 'glucose'])
+        env = environment.Environment(conf, ['energy', 'water'])
+        self.assertEqual(net.objectiveSpace.dict(env.takeAction(animat, 'eat')), {'energy': 0.5})
+        animat.position = (1, 0)
+        self.assertEqual(net.objectiveSpace.dict(env.takeAction(animat, 'eat')), {'energy': -0.1, 'water': -0.1})
+
+    def test_batched_step(self):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'example-1-copepod.json')) as fp:
+            conf = json.load(fp)
+        conf['playback'] = False
+        agentConfig = agent.AgentConfig(conf['agent'])
+
+        def run(batched, numAgents, steps):
+            random.seed(1)
+            env = environment.Environment(environment.EnvironmentConfig(dict(conf, batched=batched)))
+            animats = [agent.createAgent(agentConfig, {k:1 for k in conf['objectives']}) for _ in range(numAgents)]
+            for i, animat in enumerate(animats):
+                env.add_thing(animat, i)
+            env.run(steps)
+            return env, animats
+
+        sequential, (a,) = run(False, 1, 200)
+        batched, (b,) = run(True, 1, 200)
+        self.assertEqual(list(b.trail), list(a.trail))
+        self.assertEqual(b.wellbeeingTrail, a.wellbeeingTrail)
+        self.assertEqual((b.position, b.orientation), (a.position, a.orientation))
+        self.assertEqual(batched.world.tolist(), sequential.world.tolist())
+
+        # Both agents eat the same cell, the first one transforms it
+        env, animats = run(True, 3, 0)
+        env.world[0, :2] = env.config.blockCode('a')
+        animats[2].position = (1, 0)
+        for animat in animats:
+            animat.program = lambda _: ('eat', None, 0)
+            animat.takeAction = lambda action, reward: None
+        env.step()
+        self.assertEqual(env.dirtyCells, {(0, 0), (1, 0)})
+        self.assertEqual(env.currentCell(animats[0]), 'b')
+
+        # Agents without an action don't act
+        env, animats = run(True, 2, 0)
+        animats[0].program = lambda _: (None, None, 0)
+        animats[1].program = lambda _: ('eat', None, 0)
+        taken = []
+        for animat in animats:
+            animat.takeAction = lambda action, reward, animat=animat: taken.append((animat, action[0]))
+        position = animats[0].position
+        env.step()
+        self.assertNotIn(None, env.config.motorNames)
+        self.assertNotIn('None', env.config.motorNames)
+        self.assertEqual(animats[0].position, position)
+        self.assertEqual(taken, [(animats[1], 'eat')])
+
+    def test_field_of_view(self):
+        view = fieldofview.FieldOfView('cone', 1)
+        self.assertEqual(view.slots(), [(0, 0), (1, -1), (1, 0), (1, 1)])
+        offsets = view.offsets(agent.ORIENTATION_MATRIX)
+        self.assertEqual(offsets[2].tolist(), [[0, 0], [1, -1], [1, 0], [1, 1]])
+        self.assertEqual(offsets[4].tolist(), [[0, 0], [1, 1], [0, 1], [-1, 1]])
+        self.assertEqual(offsets[1].tolist(), [[0, 0], [0, -1], [1, -1], [1, 0]])
+        self.assertEqual(offsets[7].tolist(), [[0, 0], [-1, 0], [-1, -1], [0, -1]])
+        wide = fieldofview.FieldOfView('cone', 2).offsets(agent.ORIENTATION_MATRIX)
+        self.assertEqual(wide[3, 4:].tolist(), [[2, 0], [2, 1], [2, 2], [1, 2], [0, 2]])
+        self.assertEqual(fieldofview.parseSensorName('a@1,-1'), ('a', (1, -1)))
+        self.assertEqual(fieldofview.parseSensorName('a'), ('a', (0, 0)))
+        self.assertRaises(ValueError, fieldofview.FieldOfView, 'circle')
+
+        conf = environment.EnvironmentConfig({'world': 'abb\nbbb\nbbb', 'blocks': {'a': {'a': 1}, 'b': {'b': 1}}})
+        env = environment.Environment(conf)
+        square = createNetwork(field_of_view={'shape': 'square', 'radius': 1})
+        cone = createNetwork(field_of_view={'shape': 'cone', 'radius': 1})
+        self.assertEqual(len(square.sensors), 18)
+        self.assertEqual([x.name for x in cone.sensors], ['$a', '$b', '$a@1,-1', '$b@1,-1', '$a@1,0', '$b@1,0', '$a@1,1', '$b@1,1'])
+
+        animats = [agent.Agent(agent.AgentConfig({}), net, position=(1, 1)) for net in [square, cone]]
+        for animat in animats:
+            env.percept(animat)
+        self.assertEqual(sorted(x.name for x in square.activeSensors()),
+                         ['$a@-1,-1', '$b', '$b@-1,0', '$b@-1,1', '$b@0,-1', '$b@0,1', '$b@1,-1', '$b@1,0', '$b@1,1'])
+        self.assertEqual(sorted(x.name for x in cone.activeSensors()), ['$a@1,-1', '$b', '$b@1,0', '$b@1,1'])
+
+        # Looking right from the corner, the cells right of it are outside
+        animats[1].position = (2, 0)
+        animats[1].orientation = 2
+        env.percept(animats[1])
+        self.assertEqual(sorted(x.name for x in cone.activeSensors()), ['$b'])
+        conf.is_torus = True
+        env.percept(animats[1])
+        self.assertEqual(sorted(x.name for x in cone.activeSensors()), ['$a@1,0', '$b', '$b@1,-1', '$b@1,1'])
+        self.assertEqual(env._senseMasks(animats[1:], env._perception(cone)), [cone._active])
+
+    def test_compiled_field_of_view(self):
+        conf = environment.EnvironmentConfig({'world': 'abb\nbab\nbba', 'torus': True, 'blocks': {'a': {'a': 1}, 'b': {'b': 1}}})
+        env = environment.Environment(conf)
+        net = createNetwork(field_of_view={'shape': 'cone', 'radius': 1}, epsilon=0.0)
+        ahead, here = net.findNode('$a@1,0'), net.findNode('$b')
+        both = nodes.AndNode(inputs=[ahead, here])
+        seq = nodes.SEQNode(inputs=[here, net.findNode('$a@1,1')])
+        net.addNodes([both, seq])
+        both.updateQ('eat', {'energy': 0.5, 'water': 0.0}, {})
+        seq.updateQ('left', {'energy': 0.0, 'water': 0.8}, {})
+
+        compiled = net.compile()
+        animat = agent.Agent(agent.AgentConfig({}), net)
+        status = {'energy': 0.2, 'water': 0.5}
+        seen = set()
+        for position, orientation in [((1, 0), 2), ((0, 1), 1), ((0, 1), 4), ((2, 1), 6), ((1, 2), 3), ((0, 0), 0)]:
+            animat.position, animat.orientation = position, orientation
+            mask = env._senseMasks([animat], env._perception(net))[0]
+            net.tickSensors(mask)
+            compiled.tickSensors(mask)
+            self.assertEqual(compiled.activeTopNodes(), net.activeTopNodes())
+            self.assertEqual(compiled.getBestAction(status)[1], net.getBestAction(status)[1])
+            seen.update(compiled.activeTopNodes())
+        self.assertTrue(both in seen and seq in seen)
+
+    def test_trail(self):
+        steps = [(['$a'], 'eat', 1), (['$a', '$b'], 'left', 0.5), ([], 'eat', 0.25)]
+        memory = trail.Trail(chunkSize=2)
+        for step in steps:
+            memory.append(*step)
+        self.assertEqual(list(memory), [(cell, action) for cell, action, _ in steps])
+        self.assertEqual(list(memory.iterWellbeeings()), [1.0, 0.5, 0.25])
+
+        with tempfile.TemporaryDirectory() as outputDir:
+            path = os.path.join(outputDir, 'trail.bin')
+            streamed = trail.Trail(chunkSize=2)
+            streamed.append(*steps[0])
+            streamed.open(path)
+            for step in steps[1:]:
+                streamed.append(*step)
+            data, cells, actions = trail.readTrail(path)
+            self.assertEqual([(cells[x['cell']], actions[x['action']]) for x in data], [(['$a'], 'eat'), (['$a', '$b'], 'left')])
+            streamed.close()
+            self.assertEqual(len(trail.readTrail(path)[0]), 3)
+            self.assertEqual(list(streamed), [(cell, action) for cell, action, _ in steps])
+            self.assertEqual(len(streamed), 3)
+
+    # Recording trails doesn't keep a file open per trail
+    def test_trail_file_descriptors(self):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        numTrails = 2*len(os.listdir('/proc/self/fd')) + 64
+        with tempfile.TemporaryDirectory() as outputDir:
+            trails = [trail.Trail(chunkSize=1) for _ in range(2*numTrails)]
+            resource.setrlimit(resource.RLIMIT_NOFILE, (numTrails, hard))
+            try:
+                for i, t in enumerate(trails):
+                    t.open(os.path.join(outputDir, 'trail-%d.bin' % i))
+                for t in trails:
+                    t.append(['$a'], 'eat', 1)
+                    t.append([], 'left', 0.5)
+                for t in trails:
+                    t.close()
+            finally:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+            data, cells, actions = trail.readTrail(os.path.join(outputDir, 'trail-%d.bin' % (len(trails) - 1)))
+            self.assertEqual([(cells[x['cell']], actions[x['action']]) for x in data], [(['$a'], 'eat'), ([], 'left')])
+
+    def test_wellbeeing_format(self):
+        self.assertEqual([animats.main.formatWellbeeing(w) for w in [1.0, 0.0, 0.999, -0.5]], ['1', '0', '0,999', '-0,5'])
+
+    def test_compiled_network(self):
+        net = createNetwork(sensors=('a', 'b', 'c'), epsilon=0.0)
+        a, b, c = net.findNode('$a'), net.findNode('$b'), net.findNode('$c')
+        both = nodes.AndNode(inputs=[a, b])
+        seq = nodes.SEQNode(inputs=[both, c])
+        nand = nodes.NAndNode(inputs=[c])
+        net.addNodes([both, seq, nand])
+        both.updateQ('eat', {'energy': 0.5, 'water': 0.0}, {})
+        seq.updateQ('left', {'energy': 0.0, 'water': 0.8}, {})
+        nand.updateQ('eat', {'energy': -0.2, 'water': 0.1}, {})
+
+        compiled = net.compile()
+        status = {'energy': 0.2, 'water': 0.5}
+        for observation in [{'a': 1, 'b': 1}, {'c': 1}, {'c': 1}, {}, {'a': 1}, {'a': 1, 'b': 1, 'c': 1}]:
+            net.tick(observation)
+            compiled.tick(observation)
+            self.assertEqual(compiled.activeTopNodes(), net.activeTopNodes())
+            self.assertEqual(compiled.getBestAction(status)[1], net.getBestAction(status)[1])
+
+
 # Main
 # ====
 